@@ -0,0 +1,49 @@
+import hashlib
+import math
+import os
+import tempfile
+import numpy as np
+
+# Decoded audio cache. The first open of a file decodes and resamples it once
+# into a float32 .npy file; later opens just memory-map that file, so they are
+# near-instant and only the pages that are actually sliced (see
+# stft_zoom.slice_signal) are ever read from disk.
+
+CACHE_DIR = os.environ.get('STFT_ZOOM_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'stft-zoom'))
+
+# The cache key changes whenever the file is modified (size or mtime) or is
+# opened at a different sample rate
+def cache_file(path, sr, cache_dir=CACHE_DIR):
+    st = os.stat(path)
+    key = '%s|%d|%d|%s' % (os.path.abspath(path), st.st_size, st.st_mtime_ns, sr)
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+def open_audio(path, sr=44100, cache_dir=CACHE_DIR):
+    cached = cache_file(path, sr, cache_dir)
+    if not os.path.exists(cached):
+        y = decode(path, sr)
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first, so an interrupted decode never
+        # leaves a truncated cache file behind
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, y.astype(np.float32, copy=False))
+        os.replace(tmp, cached)
+    return np.load(cached, mmap_mode='r')
+
+# Mono float32 signal of the file at rate sr. Formats libsndfile reads (wav,
+# flac, ogg...) go through soundfile, resampled with scipy if needed; librosa
+# (much slower to load) is only imported for the others.
+def decode(path, sr=44100):
+    try:
+        import soundfile
+        data, file_sr = soundfile.read(path, dtype='float32', always_2d=True)
+    except (ImportError, RuntimeError): # soundfile.LibsndfileError is a RuntimeError
+        import librosa
+        return librosa.load(path, sr=sr)[0]
+    y = data.mean(axis=1)
+    if file_sr != sr:
+        import scipy.signal
+        g = math.gcd(int(sr), int(file_sr))
+        y = scipy.signal.resample_poly(y, int(sr) // g, int(file_sr) // g).astype(np.float32)
+    return y
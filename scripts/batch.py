@@ -0,0 +1,190 @@
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import audio_store
+import specfile
+import stft_zoom
+
+# Headless batch rendering of zooms, without the GUI (and so without Tk). A job
+# manifest lists files, regions and resolutions; every file is zoomed into
+# every region at every resolution:
+#
+#   {"files": ["recordings/*.wav", "other/take1.flac"],
+#    "regions": [{"freq": [5000, 5500], "time": [1, 3]},
+#                {"freq": [0, 2000], "time": null}],
+#    "resolutions": [["freq. bins", 40, "time frames", 0],
+#                    ["Hz per bin", 5, "ms per bin", 10]],
+#    "sr": 44100}
+#
+# files are glob patterns, relative to the manifest; "time": null is the whole
+# file; resolutions and sr are optional (GUI defaults). Files are spread over a
+# pool of processes, one task per file (it is decoded once and all its regions
+# go through stft_zoom.stft_zoom_batch). Each zoom is written to
+#
+#   <output>/<file name>-<hash of its path>/<region>_<resolution>.npz (D, x_axis, y_axis)
+#   <output>/<file name>-<hash of its path>/<region>_<resolution>.png
+#   <output>/<file name>-<hash of its path>/<region>_<resolution>.spec (see specfile.py)
+#
+# Outputs are written to a temporary file and renamed, so a crashed or killed
+# run never leaves a truncated one behind: running it again only computes the
+# outputs that are missing (unless --force).
+#
+#   python scripts/batch.py manifest.json -o zooms [-j 8] [--format npz png spec]
+
+RESOLUTION = ('freq. bins', 40, 'time frames', 0) # same defaults as the GUI
+FORMATS = ('npz',)
+UNITS = {'freq. bins': 'bins', 'Hz per bin': 'hz', 'time frames': 'frames', 'ms per bin': 'ms'}
+
+def load_manifest(path):
+    with open(path) as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    files = []
+    for pattern in manifest['files']:
+        matches = sorted(glob.glob(os.path.join(base, pattern)))
+        if not matches:
+            print('warning: no files match %s' % pattern, file=sys.stderr)
+        files += [match for match in matches if match not in files]
+    regions = [(tuple(region['freq']), region.get('time') and tuple(region['time'])) for region in manifest['regions']]
+    resolutions = [tuple(res) for res in manifest.get('resolutions', [RESOLUTION])]
+    return files, regions, resolutions, manifest.get('sr', 44100)
+
+def file_dir(output, path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output, '%s-%s' % (name, hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]))
+
+def output_name(freq_range, time_range, res):
+    times = 'all' if time_range is None else '%g-%gs' % tuple(time_range)
+    return '%g-%gHz_%s_%g%s-%g%s' % (freq_range[0], freq_range[1], times, res[1], UNITS[res[0]], res[3], UNITS[res[2]])
+
+# The zooms of path still to be done: list of (freq_range, time_range, res, base
+# output path, formats missing)
+def pending_zooms(output, path, regions, resolutions, formats, force=False):
+    directory = file_dir(output, path)
+    pending = []
+    for freq_range, time_range in regions:
+        for res in resolutions:
+            base = os.path.join(directory, output_name(freq_range, time_range, res))
+            missing = [fmt for fmt in formats if force or not os.path.exists(base + '.' + fmt)]
+            if missing:
+                pending.append((freq_range, time_range, res, base, missing))
+    return pending
+
+# Runs on a worker process: zooms one file and writes its outputs. An output
+# that cannot be written does not stop the others. Returns (path, number of
+# outputs written, seconds of audio, list of (output, error) that failed).
+def render_file(path, zooms, sr, audio_cache=True):
+    stft_zoom.FFT_WORKERS = 1 # the pool already has a process per CPU
+    if audio_cache:
+        y = audio_store.open_audio(path, sr)
+    else:
+        y = audio_store.decode(path, sr)
+    duration = len(y) / sr
+    regions = [(freq_range, time_range or (0, duration)) + res for freq_range, time_range, res, _, _ in zooms]
+    results = stft_zoom.stft_zoom_batch(y, regions, sr)
+
+    os.makedirs(os.path.dirname(zooms[0][3]), exist_ok=True)
+    written = 0
+    errors = []
+    for (_, _, _, base, formats), zoom in zip(zooms, results):
+        for fmt in formats:
+            try:
+                write_atomic(base + '.' + fmt, SAVERS[fmt], zoom)
+            except Exception as error:
+                errors.append((base + '.' + fmt, repr(error)))
+                continue
+            written += 1
+    return path, written, duration, errors
+
+def write_atomic(path, save, zoom):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.' + path.rsplit('.', 1)[1])
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            save(zoom, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def save_npz(zoom, f):
+    D, x_axis, y_axis = zoom
+    np.savez(f, D=D, x_axis=x_axis, y_axis=y_axis)
+
+# uint8 over [-80, 0] dB: 1 byte per value instead of 4 (see specfile.py for the error)
+def save_spec(zoom, f):
+    specfile.save(f, *zoom)
+
+# Agg canvas directly (no pyplot), so nothing ever needs a display
+def save_png(zoom, f):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import display
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    display.specshow(*zoom, ax=figure.add_subplot(111))
+    figure.savefig(f, format='png')
+
+SAVERS = {'npz': save_npz, 'png': save_png, 'spec': save_spec}
+
+# Returns what failed: files that could not be zoomed and outputs that could not be written
+def run(manifest, output, workers=None, formats=FORMATS, force=False, audio_cache=True):
+    files, regions, resolutions, sr = load_manifest(manifest)
+    tasks = []
+    skipped = 0
+    for path in files:
+        zooms = pending_zooms(output, path, regions, resolutions, formats, force)
+        skipped += len(regions) * len(resolutions) * len(formats) - sum(len(zoom[4]) for zoom in zooms)
+        if zooms:
+            tasks.append((path, zooms))
+    print('%d files, %d outputs to write, %d already done' % (len(files), sum(len(zoom[4]) for _, zooms in tasks for zoom in zooms), skipped), file=sys.stderr)
+
+    t0 = time.perf_counter()
+    written = 0
+    audio = 0.0
+    done = 0
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render_file, path, zooms, sr, audio_cache): path for path, zooms in tasks}
+        for n, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            path = futures[future]
+            try:
+                _, n_written, duration, errors = future.result()
+            except Exception as error:
+                failed.append(path)
+                print('[%d/%d] %s: error: %r' % (n, len(tasks), path, error), file=sys.stderr)
+                continue
+            written += n_written
+            audio += duration
+            done += 1
+            print('[%d/%d] %s: %d outputs' % (n, len(tasks), path, n_written), file=sys.stderr)
+            for output_path, error in errors:
+                failed.append(output_path)
+                print('  %s: error: %s' % (output_path, error), file=sys.stderr)
+
+    elapsed = time.perf_counter() - t0
+    print('wrote %d outputs in %.1f s (%.1f files/s, %.1f s of audio per s), %d failed'
+          % (written, elapsed, done / max(elapsed, 1e-9), audio / max(elapsed, 1e-9), len(failed)), file=sys.stderr)
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Renders zooms of many files without the GUI.')
+    parser.add_argument('manifest', help='JSON job manifest (files x regions x resolutions)')
+    parser.add_argument('-o', '--output', required=True, help='output directory')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='worker processes (default: number of CPUs)')
+    parser.add_argument('--format', nargs='+', choices=sorted(SAVERS), default=list(FORMATS), dest='formats')
+    parser.add_argument('--force', action='store_true', help='recompute outputs that already exist')
+    parser.add_argument('--no-audio-cache', dest='audio_cache', action='store_false',
+                        help='decode the files directly instead of through the decoded audio cache (audio_store.py)')
+    args = parser.parse_args(argv)
+    failed = run(args.manifest, args.output, args.jobs, args.formats, args.force, args.audio_cache)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,40 @@
+import timeit
+import numpy as np
+import stft_zoom
+
+# Compares the filter backend of stft_zoom (filter_and_decimate +
+# analyze_slice) with the chirp-Z backend (czt_analyze) over band widths,
+# slice durations and resolutions.
+#
+#   python scripts/bench_czt.py
+
+CENTRE = 5000
+WIDTHS = [20, 100, 500, 2000]
+DURATIONS = [0.25, 1, 4, 16]
+RESOLUTIONS = [('freq. bins', 40, 'time frames', 0),
+               ('freq. bins', 40, 'time frames', 8),
+               ('Hz per bin', 5, 'ms per bin', 100)]
+
+def best_of(f, repeat=3):
+    return min(timeit.repeat(f, number=1, repeat=repeat))
+
+def main(sr=44100):
+    rng = np.random.default_rng(0)
+    y = rng.standard_normal(int((max(DURATIONS) + 1) * sr)).astype(np.float32)
+    print('filter / czt time (ms) and ratio; czt wins where the ratio is > 1')
+    for res in RESOLUTIONS:
+        print()
+        print('resolution: %s %g, %s %g' % res)
+        print('%10s' % 'width (Hz)' + ''.join('%18s' % ('%g s' % d) for d in DURATIONS))
+        for width in WIDTHS:
+            freq_range = (CENTRE - width/2, CENTRE + width/2)
+            row = []
+            for duration in DURATIONS:
+                time_range = [0.5, 0.5 + duration]
+                t_filter = best_of(lambda: stft_zoom.stft_zoom(y, freq_range, time_range, sr, *res))
+                t_czt = best_of(lambda: stft_zoom.stft_zoom(y, freq_range, time_range, sr, *res, backend='czt'))
+                row.append('%7.1f/%-6.1f%4.1f' % (1000*t_filter, 1000*t_czt, t_filter/t_czt))
+            print('%10g' % width + ''.join('%18s' % r for r in row))
+
+if __name__ == '__main__':
+    main()
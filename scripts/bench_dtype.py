@@ -0,0 +1,63 @@
+import sys
+import timeit
+import tracemalloc
+import numpy as np
+import stft_zoom
+
+# Accuracy, time and memory of stft_zoom with stft_zoom.DTYPE = float32 (the
+# default) against float64, for every plan of a few bands, on both paths.
+# The error is in dB, over the bins that are within 60 dB of the maximum in
+# the float64 result (below that the float64 result is itself mostly
+# filter leakage).
+#
+#   python scripts/bench_dtype.py [seconds]
+
+BANDS = [(0, 500), (0, 2000), (300, 400), (1000, 4000), (1600, 1900), (5000, 5500), (10000, 12000), (15000, 15200)]
+RESOLUTION = ('freq. bins', 40, 'time frames', 0)
+FLOOR = -60 # dB
+
+def synthetic_signal(seconds, sr):
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sr)) / sr
+    y = 0.01 * rng.standard_normal(len(t))
+    for f in (440, 1750, 3050, 5210, 11000, 15100):
+        y += np.sin(2 * np.pi * f * t)
+    return y.astype(np.float32)
+
+def run(y, freq_range, time_range, sr, plan, fused, dtype):
+    stft_zoom.DTYPE = dtype
+    zoom = lambda: stft_zoom.stft_zoom(y, freq_range, time_range, sr, *RESOLUTION, fused=fused, plan=plan)
+    D = zoom()[0]
+    wall = min(timeit.repeat(zoom, number=1, repeat=3))
+    tracemalloc.start()
+    try:
+        zoom()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return D, wall, peak
+
+def main(seconds=20, sr=44100):
+    y = synthetic_signal(float(seconds) + 1, sr)
+    time_range = [0.5, 0.5 + float(seconds)]
+    default = stft_zoom.DTYPE
+    print('%-14s %-15s %-9s %9s %9s %7s %7s %7s' % ('band', 'strategy', 'path', 'max dB', 'rms dB', 'time', 'memory', 'dtype'))
+    errors = []
+    try:
+        for freq_range in BANDS:
+            for plan in stft_zoom.zoom_plans(freq_range, sr):
+                for fused in (True, False):
+                    D64, t64, m64 = run(y, freq_range, time_range, sr, plan, fused, np.float64)
+                    D32, t32, m32 = run(y, freq_range, time_range, sr, plan, fused, np.float32)
+                    diff = np.abs(D32.astype(np.float64) - D64)[D64 > FLOOR]
+                    errors.append(diff.max())
+                    print('%-14s %-15s %-9s %9.4f %9.4f %6.2fx %6.2fx %7s'
+                          % (freq_range, plan['strategy'], 'fused' if fused else 'original', diff.max(),
+                             np.sqrt(np.mean(diff**2)), t32 / t64, m32 / m64, D32.dtype))
+    finally:
+        stft_zoom.DTYPE = default
+    print()
+    print('float32 vs float64: worst error %.4f dB, median of the per-case worst %.4f dB' % (np.max(errors), np.median(errors)))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
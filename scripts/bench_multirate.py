@@ -0,0 +1,40 @@
+import sys
+import timeit
+import numpy as np
+import stft_zoom
+
+# Times filter_and_mod + subsample_signal (original path) against
+# filter_and_decimate (multirate engine) for bands that go through each of the
+# filter_and_mod strategies.
+#
+#   python scripts/bench_multirate.py [seconds]
+
+BANDS = [(0, 500), (100, 2000), (1000, 4000), (2000, 3000), (5000, 5500), (10000, 12000)]
+
+def original_path(y, freq_range, sr):
+    y_mod, new_sr, _, _ = stft_zoom.filter_and_mod(y, freq_range, sr)
+    return stft_zoom.subsample_signal(y_mod, new_sr, sr)
+
+def fused_path(y, freq_range, sr):
+    return stft_zoom.filter_and_decimate(y, freq_range, sr)[:2]
+
+def best_of(f, repeat=5):
+    return min(timeit.repeat(f, number=1, repeat=repeat))
+
+def main(seconds=10, sr=44100):
+    rng = np.random.default_rng(0)
+    y = rng.standard_normal(int(seconds * sr)).astype(np.float32)
+    rows = []
+    for freq_range in BANDS:
+        strategy = stft_zoom.zoom_plan(freq_range, sr)['strategy']
+        t_orig = best_of(lambda: original_path(y, freq_range, sr))
+        t_fused = best_of(lambda: fused_path(y, freq_range, sr))
+        rows.append((freq_range, strategy, t_orig, t_fused))
+
+    print('%d s of audio at %d Hz' % (seconds, sr))
+    print('%-14s %-15s %10s %10s %8s' % ('band', 'strategy', 'orig (ms)', 'fused (ms)', 'speedup'))
+    for freq_range, strategy, t_orig, t_fused in rows:
+        print('%-14s %-15s %10.1f %10.1f %7.1fx' % (freq_range, strategy, 1000*t_orig, 1000*t_fused, t_orig/t_fused))
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:2]])
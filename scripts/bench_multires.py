@@ -0,0 +1,47 @@
+import sys
+import time
+import numpy as np
+import bench_dtype
+import stft_zoom
+
+# Time of stft_zoom_multires against one stft_zoom call per resolution (the
+# filtering and decimation repeated every time), for a growing number of
+# resolutions of the same region, on both paths. The results are the same.
+#
+#   python scripts/bench_multires.py [seconds]
+
+BANDS = [(0, 2000), (5000, 5500), (1000, 4000)]
+RESOLUTIONS = [('freq. bins', 20, 'time frames', 0), ('freq. bins', 40, 'time frames', 0),
+               ('freq. bins', 80, 'time frames', 0), ('freq. bins', 160, 'time frames', 0),
+               ('Hz per bin', 2, 'ms per bin', 50), ('Hz per bin', 20, 'ms per bin', 5),
+               ('freq. bins', 40, 'time frames', 200), ('freq. bins', 400, 'time frames', 0)]
+COUNTS = [1, 2, 4, 8]
+
+def timed(f, repeat=3):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+def main(seconds=30, sr=44100):
+    seconds = float(seconds)
+    y = bench_dtype.synthetic_signal(seconds + 1, sr)
+    time_range = [0.5, 0.5 + seconds]
+    print('%g s region; time (ms) of N separate stft_zoom calls / stft_zoom_multires' % seconds)
+    print('%-14s %-9s' % ('band', 'path') + ''.join('%16s' % ('N = %d' % n) for n in COUNTS))
+    for freq_range in BANDS:
+        for fused in (True, False):
+            row = []
+            for n in COUNTS:
+                resolutions = RESOLUTIONS[:n]
+                separate = lambda: [stft_zoom.stft_zoom(y, freq_range, time_range, sr, *res, fused=fused) for res in resolutions]
+                multires = lambda: stft_zoom.stft_zoom_multires(y, freq_range, time_range, sr, resolutions, fused=fused)
+                for (D, _, _), (D_multi, _, _) in zip(separate(), multires()):
+                    assert np.allclose(D, D_multi, atol=1e-3)
+                row.append('%7.1f / %-6.1f' % (1000 * timed(separate), 1000 * timed(multires)))
+            print('%-14s %-9s' % (freq_range, 'fused' if fused else 'original') + ''.join('%16s' % r for r in row))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,42 @@
+import sys
+import time
+import numpy as np
+import pan
+import stft_zoom
+
+# Time of a pan of a PanSession against computing the new window from
+# scratch with stft_zoom (original path), for pans of increasing distance,
+# forward and back.
+#
+#   python scripts/bench_pan.py [window seconds]
+
+BANDS = [(0, 2000), (5000, 5500), (1000, 4000)]
+RESOLUTION = ('freq. bins', 200, 'time frames', 0)
+DISTANCES = [0.1, 0.3, 1, 3, 10] # seconds
+
+def timed(f):
+    t0 = time.perf_counter()
+    f()
+    return time.perf_counter() - t0
+
+def main(window=30, sr=44100):
+    window = float(window)
+    y = np.random.default_rng(0).standard_normal(int((2*window + max(DISTANCES) + 10) * sr)).astype(np.float32)
+    time_range = [5, 5 + window]
+    print('pan forward / back (ms) by distance; from scratch: stft_zoom of one window')
+    print('%-14s %12s' % ('band', 'scratch') + ''.join('%14s' % ('%g s' % d) for d in DISTANCES))
+    for freq_range in BANDS:
+        session = pan.PanSession(y, freq_range, sr, *RESOLUTION)
+        session.zoom(time_range)
+        zoom = lambda: stft_zoom.stft_zoom(y, freq_range, time_range, sr, *RESOLUTION, fused=False)
+        zoom()
+        scratch = min(timed(zoom) for _ in range(3))
+        row = []
+        for distance in DISTANCES:
+            forward = timed(lambda: session.zoom([time_range[0] + distance, time_range[1] + distance]))
+            back = timed(lambda: session.zoom(time_range))
+            row.append('%6.1f/%-6.1f' % (1000*forward, 1000*back))
+        print('%-14s %12.1f' % (freq_range, 1000*scratch) + ''.join('%14s' % r for r in row))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+import numpy as np
+import bench_dtype
+import parallel
+import stft_zoom
+
+# Time of parallel.ParallelZoom against stft_zoom (serial) for long zooms,
+# with 1, 2, 4... workers up to max_workers (the number of CPUs by default),
+# and the largest difference from the serial result (dB, over the bins within
+# 60 dB of the maximum), on both paths.
+#
+#   python scripts/bench_parallel.py [seconds] [max_workers]
+
+BANDS = [(0, 8000), (1000, 4000), (5000, 5500)]
+RESOLUTION = ('freq. bins', 400, 'time frames', 0)
+FLOOR = -60 # dB
+
+def timed(f, repeat=3):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+def main(seconds=300, max_workers=None, sr=44100):
+    seconds = float(seconds)
+    y = bench_dtype.synthetic_signal(seconds + 1, sr)
+    time_range = [0.5, 0.5 + seconds]
+    cpus = os.cpu_count() or 1
+    max_workers = int(max_workers or cpus)
+    counts = sorted({2**i for i in range(max_workers.bit_length())} | {max_workers})
+    print('%d s zoom, %d CPUs; time (s), speedup over serial and max error (dB) by workers' % (seconds, cpus))
+    print('%-14s %-9s %8s' % ('band', 'path', 'serial') + ''.join('%22s' % ('%d' % n) for n in counts))
+    for freq_range in BANDS:
+        for fused in (True, False):
+            serial, (D, _, _) = timed(lambda: stft_zoom.stft_zoom(y, freq_range, time_range, sr, *RESOLUTION, fused=fused))
+            row = []
+            for workers in counts:
+                with parallel.ParallelZoom(workers) as executor:
+                    executor.zoom(y, freq_range, time_range, sr, *RESOLUTION, fused=fused) # start the workers
+                    wall, (D_par, _, _) = timed(lambda: executor.zoom(y, freq_range, time_range, sr, *RESOLUTION, fused=fused))
+                error = np.abs(D_par - D)[D > FLOOR].max()
+                row.append('%7.2f %5.2fx %7.4f' % (wall, serial / wall, error))
+            print('%-14s %-9s %8.2f' % (freq_range, 'fused' if fused else 'original', serial) + ''.join('%22s' % r for r in row))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
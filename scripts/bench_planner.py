@@ -0,0 +1,78 @@
+import sys
+import numpy as np
+import scipy.optimize
+import planner
+
+# Checks the cost model of planner.py against measured times. Every valid plan
+# of every case is run (best of a few runs, through the measure hook); the
+# script prints, per case, the plan the planner picks against the one that
+# was actually fastest, the estimate error over all runs, and COSTS fitted to
+# this machine (least squares, non-negative), to paste into planner.py.
+#
+#   python scripts/bench_planner.py [fused|original]
+
+BANDS = [(0, 500), (100, 2000), (300, 400), (1000, 4000), (2000, 3000), (3000, 3100),
+         (5000, 5500), (7000, 7300), (10000, 12000), (15000, 15200)]
+DURATIONS = [0.5, 2, 8]
+RESOLUTIONS = [('freq. bins', 40, 'time frames', 0), ('Hz per bin', 5, 'ms per bin', 50)]
+
+def measure(y, freq_range, time_range, sr, res, plan, fused, repeat=3):
+    runs = []
+    previous = planner.set_measure_hook(lambda plan, measured: runs.append(measured))
+    try:
+        for _ in range(repeat):
+            planner.zoom(y, freq_range, time_range, sr, *res, fused=fused, plan=plan)
+    finally:
+        planner.set_measure_hook(previous)
+    return {stage: min(run[stage] for run in runs) for stage in ('filter', 'stft')}
+
+def main(path='fused', sr=44100):
+    fused = path == 'fused'
+    rng = np.random.default_rng(0)
+    y = rng.standard_normal(int((max(DURATIONS) + 1) * sr)).astype(np.float32)
+
+    rows = [] # (work, measured seconds) of every stage run
+    ratios = []
+    picked_fastest = 0
+    regrets = []
+    priority_regrets = [] # of the plan stft_zoom.zoom_plan picks, the first one
+    print('%-14s %5s %-22s %-16s %-16s %7s' % ('band', 'dur.', 'resolution', 'planner', 'fastest', 'regret'))
+    for freq_range in BANDS:
+        for duration in DURATIONS:
+            time_range = [0.5, 0.5 + duration]
+            for res in RESOLUTIONS:
+                plans = [plan for plan in planner.candidates(freq_range, time_range, sr, *res, fused=fused) if plan['cost']]
+                times = []
+                for plan in plans:
+                    measured = measure(y, freq_range, time_range, sr, res, plan, fused)
+                    for stage in ('filter', 'stft'):
+                        rows.append((plan['cost'][stage + '_work'], measured[stage]))
+                        ratios.append(plan['cost'][stage] / measured[stage])
+                    times.append(measured['filter'] + measured['stft'])
+                chosen = min(range(len(plans)), key=lambda i: plans[i]['cost']['time'])
+                fastest = int(np.argmin(times))
+                picked_fastest += chosen == fastest
+                regrets.append(times[chosen] / times[fastest])
+                priority_regrets.append(times[0] / times[fastest])
+                print('%-14s %5g %-22s %-16s %-16s %6.2fx' % (freq_range, duration, '%s %g, %s %g' % res,
+                      plans[chosen]['strategy'], plans[fastest]['strategy'], regrets[-1]))
+
+    n_cases = len(regrets)
+    ratios = np.array(ratios)
+    print()
+    print('planner picked the fastest plan in %d of %d cases, mean regret %.2fx, worst %.2fx'
+          % (picked_fastest, n_cases, np.mean(regrets), np.max(regrets)))
+    print('fixed priority order (zoom_plan): mean regret %.2fx, worst %.2fx'
+          % (np.mean(priority_regrets), np.max(priority_regrets)))
+    print('estimated / measured time per stage: median %.2f, 10%%-90%% %.2f-%.2f'
+          % tuple(np.percentile(ratios, [50, 10, 90])))
+
+    # relative least squares, so short and long runs weigh the same
+    A = np.array([[work[kind] / t for kind in planner.WORK_KINDS] for work, t in rows])
+    used = A.any(axis=0) # kinds of work this path does not do keep their cost
+    costs = np.array([planner.COSTS[kind] for kind in planner.WORK_KINDS])
+    costs[used], _ = scipy.optimize.nnls(A[:, used], np.ones(len(rows)))
+    print('fitted COSTS = {%s}' % ', '.join("'%s': %.2g" % (kind, c) for kind, c in zip(planner.WORK_KINDS, costs)))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import server
+
+# Load generator for server.py: each of clients connections sends zoom
+# requests one after the other, drawn at random from distinct different ones
+# (fewer distinct requests means more of them coalesced or answered from the
+# cache), and the latencies are reported as percentiles. Without --address it starts
+# a server on a Unix socket in a temporary directory, and without --file it
+# zooms into a synthetic recording.
+#
+#   python scripts/bench_server.py [--address /tmp/stft-zoom.sock] [--file take1.wav]
+#                                  [--clients 8] [--requests 20] [--distinct 16]
+
+SR = 44100
+BANDS = [(0, 2000), (300, 400), (1000, 4000), (5000, 5500), (10000, 12000)]
+RESOLUTION = ('freq. bins', 40, 'time frames', 0)
+WINDOW = 5 # seconds
+PERCENTILES = [50, 90, 99]
+
+def distinct_requests(n, duration, rng):
+    starts = rng.uniform(0, max(duration - WINDOW, 0), n).round(1)
+    bands = rng.integers(len(BANDS), size=n)
+    return [(BANDS[b], (t, min(t + WINDOW, duration))) for b, t in zip(bands, starts)]
+
+async def client(address, path, requests, latencies):
+    connection = await server.connect(address)
+    try:
+        for freq_range, time_range in requests:
+            t0 = time.perf_counter()
+            await connection.zoom(path, freq_range, time_range, SR, *RESOLUTION)
+            latencies.append(time.perf_counter() - t0)
+    finally:
+        await connection.close()
+
+async def load(address, path, duration, clients, requests, distinct, seed=0):
+    rng = np.random.default_rng(seed)
+    pool = distinct_requests(distinct, duration, rng)
+    latencies = []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(address, path, [pool[i] for i in rng.integers(distinct, size=requests)], latencies)
+                           for _ in range(clients)))
+    elapsed = time.perf_counter() - t0
+    connection = await server.connect(address)
+    info = await connection.info()
+    await connection.close()
+    return np.array(latencies), elapsed, info
+
+def start_server(socket_path):
+    process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+                                '--unix', socket_path])
+    while not os.path.exists(socket_path):
+        if process.poll() is not None:
+            raise RuntimeError('the server exited with %d' % process.returncode)
+        time.sleep(0.05)
+    return process
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measures the latency of zoom requests to server.py.')
+    parser.add_argument('--address', help='Unix socket or host:port of a running server (default: start one)')
+    parser.add_argument('--file', help='audio file, as seen by the server (default: a synthetic one)')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent connections')
+    parser.add_argument('--requests', type=int, default=20, help='requests per client')
+    parser.add_argument('--distinct', type=int, default=16, help='different requests to draw from')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        import soundfile
+        path = args.file
+        if path is None:
+            path = os.path.join(tmp, 'load.wav')
+            t = np.arange(60 * SR) / SR
+            y = 0.01 * np.random.default_rng(0).standard_normal(len(t)) + np.sin(2 * np.pi * 5210 * t)
+            soundfile.write(path, y.astype(np.float32), SR)
+        duration = soundfile.info(path).duration
+
+        process = None
+        address = args.address
+        if address is None:
+            address = os.path.join(tmp, 'server.sock')
+            process = start_server(address)
+        try:
+            latencies, elapsed, info = asyncio.run(load(address, path, duration, args.clients, args.requests, args.distinct))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    print('%d clients x %d requests (%d distinct): %.1f requests/s' % (args.clients, args.requests, args.distinct, len(latencies) / elapsed))
+    print('latency (ms): ' + '  '.join('p%d %.1f' % (p, 1000 * np.percentile(latencies, p)) for p in PERCENTILES)
+          + '  max %.1f' % (1000 * latencies.max()))
+    cache = info['cache']
+    print('server: %d requests, %d coalesced, %d errors; cache %d hits, %d partial hits, %d misses'
+          % (info['requests'], info['coalesced'], info['errors'], cache['hits'], cache['partial_hits'], cache['misses']))
+
+if __name__ == '__main__':
+    main()
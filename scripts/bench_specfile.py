@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import bench_dtype
+import specfile
+import stft_zoom
+
+# Size, write and read time of a zoom result saved with specfile (every
+# encoding) against np.save of the float64 and float32 arrays, and the
+# largest quantization error, on a long wide-band zoom. Reading a window is
+# a 5 s window out of the middle.
+#
+#   python scripts/bench_specfile.py [seconds]
+
+RESOLUTION = ('freq. bins', 1000, 'time frames', 0)
+WINDOW = 5 # seconds
+
+def timed(f, repeat=3):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+def main(seconds=300, sr=44100):
+    seconds = float(seconds)
+    y = bench_dtype.synthetic_signal(seconds + 1, sr)
+    D, x_axis, y_axis = stft_zoom.stft_zoom(y, (0, 8000), [0.5, 0.5 + seconds], sr, *RESOLUTION)
+    middle = 0.5 + seconds / 2
+    print('D: %d bins x %d frames' % D.shape)
+    print('%-14s %10s %10s %10s %12s %12s' % ('format', 'size (MB)', 'write (ms)', 'read (ms)', 'window (ms)', 'max err (dB)'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype in (np.float64, np.float32):
+            path = os.path.join(tmp, 'D.npy')
+            D_npy = D.astype(dtype)
+            write, _ = timed(lambda: np.save(path, D_npy))
+            read, _ = timed(lambda: np.load(path))
+            window, _ = timed(lambda: np.array(np.load(path, mmap_mode='r')[:, np.searchsorted(x_axis, middle):np.searchsorted(x_axis, middle + WINDOW)]))
+            print('%-14s %10.1f %10.1f %10.1f %12.1f %12.4f' % ('npy ' + np.dtype(dtype).name, os.path.getsize(path) / 2**20,
+                                                             1000 * write, 1000 * read, 1000 * window, 0))
+        for encoding in specfile.ENCODINGS:
+            path = os.path.join(tmp, 'D.spec')
+            write, _ = timed(lambda: specfile.save(path, D, x_axis, y_axis, encoding))
+            read, (D_read, _, _) = timed(lambda: specfile.Spectrogram(path).read())
+            window, _ = timed(lambda: specfile.Spectrogram(path).window(middle, middle + WINDOW))
+            print('%-14s %10.1f %10.1f %10.1f %12.1f %12.4f' % ('spec ' + encoding, os.path.getsize(path) / 2**20,
+                                                             1000 * write, 1000 * read, 1000 * window, np.abs(D_read - D).max()))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+# Time to first spectrogram: a fresh interpreter imports the modules of the
+# GUI (all but Tk), opens an audio file (decoding it into an empty cache, see
+# audio_store.py), builds its overview (tiles.py) and draws it on an Agg
+# canvas, as gui.openfile does; then it computes a first zoom, which also
+# pays for loading scipy.signal. Times are from the start of the process.
+# The last line is the time a fresh interpreter takes to import librosa and
+# run its first stft, for comparison.
+#
+#   python scripts/bench_startup.py [seconds of audio]
+
+SR = 44100
+REPEAT = 3
+
+STARTUP = '''
+import json, sys, time
+stamps = {}
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import display, gui_util, jobs, stft_zoom, tiles, zoom_cache
+stamps['imports'] = time.time()
+y = gui_util.load_audio(sys.argv[1], %(sr)d)
+stamps['open'] = time.time()
+pyramid = tiles.open_pyramid(sys.argv[1], y, %(sr)d)
+D, x_data, y_data = pyramid.view(width=640, height=480)
+stamps['overview'] = time.time()
+figure = Figure()
+canvas = FigureCanvasAgg(figure)
+display.specshow(D, x_data, y_data, ax=figure.add_subplot(111), y_axis='log')
+canvas.draw()
+stamps['first spectrogram'] = time.time()
+stft_zoom.stft_zoom(y, (5000, 5500), [1, 3], %(sr)d, 'freq. bins', 40, 'time frames', 0)
+stamps['first zoom'] = time.time()
+print(json.dumps(stamps))
+''' % {'sr': SR}
+
+LIBROSA = '''
+import json, time
+import numpy as np
+import librosa
+librosa.stft(np.zeros(%d, dtype=np.float32), n_fft=512)
+print(json.dumps({'librosa first stft': time.time()}))
+''' % SR
+
+def run(code, *args, env=None):
+    t0 = time.time()
+    out = subprocess.run([sys.executable, '-c', code] + list(args), check=True, capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)), env=env).stdout
+    return {step: t - t0 for step, t in json.loads(out.splitlines()[-1]).items()}
+
+def main(seconds=60):
+    import soundfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'startup.wav')
+        t = np.arange(int(float(seconds) * SR)) / SR
+        soundfile.write(path, (0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32), SR)
+        runs = []
+        for i in range(REPEAT):
+            env = dict(os.environ, STFT_ZOOM_CACHE=os.path.join(tmp, 'cache%d' % i)) # decode every time
+            runs.append(run(STARTUP, path, env=env))
+        runs.append(min((run(LIBROSA) for _ in range(REPEAT)), key=lambda r: r['librosa first stft']))
+    print('seconds from process start (best of %d), %g s file' % (REPEAT, float(seconds)))
+    for step in runs[0]:
+        print('%-20s %6.2f' % (step, min(r[step] for r in runs[:-1])))
+    print('%-20s %6.2f' % ('librosa first stft', runs[-1]['librosa first stft']))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+import numpy as np
+import scipy
+import librosa
+import gui_util
+import stft_zoom
+
+# Benchmark suite for the zoom pipeline, to tell whether a change makes it
+# faster or slower. Every case runs on synthetic signals (seeded noise plus a
+# few tones) of several lengths:
+#
+#   filter/<path>/<branch>/<length>  filter_and_mod + subsample_signal (original
+#                                    path) or filter_and_decimate (fused path),
+#                                    with a band that exercises each branch
+#   analyze/<resolution>/<length>    analyze_slice of the decimated signal
+#   overview/<length>                gui_util.get_spectrogram of the whole signal
+#
+# Each case records its wall time (best of --repeat runs), the peak memory
+# allocated while it runs (tracemalloc, in a separate run) and its throughput
+# (input samples per second).
+#
+#   python scripts/bench_suite.py run -o baseline.json
+#   python scripts/bench_suite.py compare baseline.json [current.json]
+#
+# compare runs the suite again when no current results are given, prints the
+# ratios and exits with status 1 if any case got slower (or uses more memory)
+# by more than --threshold.
+
+SR = 44100
+LENGTHS = [1, 10, 60] # seconds
+REPEAT = 5
+THRESHOLD = 0.2
+MIN_DIFF = 0.5e-3 # seconds; slowdowns smaller than this are timer noise, not regressions
+
+# band and strategy of every filter_and_mod branch ('ring mod' is never the
+# first choice of zoom_plan, so the plans are always picked by strategy). The
+# undersampling rate of (5000, 5500) is found with an even n, the one of
+# (1600, 1900) with an odd n.
+BRANCHES = {'lowpass': ((0, 2000), 'lowpass'),
+            'undersampling-even': ((5000, 5500), 'undersampling'),
+            'undersampling-odd': ((1600, 1900), 'undersampling'),
+            'ring-mod': ((5000, 5500), 'ring mod'),
+            'ring-mod-lpf': ((1000, 4000), 'ring mod + lpf')}
+
+RESOLUTIONS = {'40bins-default-hop': ('freq. bins', 40, 'time frames', 0),
+               '5hz-10ms': ('Hz per bin', 5, 'ms per bin', 10),
+               '1hz-50ms': ('Hz per bin', 1, 'ms per bin', 50),
+               '200bins-100frames': ('freq. bins', 200, 'time frames', 100)}
+ANALYZE_STEP = 10 # analyze_slice runs at SR / ANALYZE_STEP, as after a zoom
+
+def synthetic_signal(seconds, sr=SR, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    y = 0.1 * rng.standard_normal(len(t))
+    for f in (440, 1750, 2500, 5210):
+        y += np.sin(2 * np.pi * f * t)
+    return y.astype(np.float32)
+
+def branch_plan(freq_range, strategy, sr=SR):
+    return next(plan for plan in stft_zoom.zoom_plans(freq_range, sr) if plan['strategy'] == strategy)
+
+def original_path(y, freq_range, plan):
+    y_mod, new_sr, _, _ = stft_zoom.filter_and_mod(y, freq_range, SR, plan=plan)
+    return stft_zoom.subsample_signal(y_mod, new_sr, SR)
+
+def fused_path(y, freq_range, plan):
+    return stft_zoom.filter_and_decimate(y, freq_range, SR, plan=plan)
+
+# (name, function, number of input samples) of every case
+def cases(lengths):
+    for seconds in lengths:
+        y = synthetic_signal(seconds)
+        for branch, (freq_range, strategy) in BRANCHES.items():
+            plan = branch_plan(freq_range, strategy)
+            yield ('filter/original/%s/%gs' % (branch, seconds),
+                   lambda y=y, freq_range=freq_range, plan=plan: original_path(y, freq_range, plan), len(y))
+            yield ('filter/fused/%s/%gs' % (branch, seconds),
+                   lambda y=y, freq_range=freq_range, plan=plan: fused_path(y, freq_range, plan), len(y))
+
+        y_sub = y[::ANALYZE_STEP]
+        for name, res in RESOLUTIONS.items():
+            yield ('analyze/%s/%gs' % (name, seconds),
+                   lambda y_sub=y_sub, res=res: stft_zoom.analyze_slice(y_sub, (0, 2000), SR / ANALYZE_STEP, *res), len(y_sub))
+
+        yield 'overview/%gs' % seconds, lambda y=y: gui_util.get_spectrogram(y, SR), len(y)
+
+def measure(fn, samples, repeat):
+    fn() # warm-up (filter design caches, lazy imports)
+    wall = min(timeit.repeat(fn, number=1, repeat=repeat))
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'time': wall, 'peak_memory': peak, 'samples': samples, 'throughput': samples / wall}
+
+def run(lengths=LENGTHS, repeat=REPEAT, pattern=None):
+    results = {}
+    for name, fn, samples in cases(lengths):
+        if pattern and pattern not in name:
+            continue
+        results[name] = measure(fn, samples, repeat)
+        r = results[name]
+        print('%-44s %9.2f ms %9.1f MB %9.2f Msamples/s'
+              % (name, 1000 * r['time'], r['peak_memory'] / 2**20, r['throughput'] / 1e6), file=sys.stderr)
+    meta = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'scipy': scipy.__version__, 'librosa': librosa.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+            'lengths': list(lengths), 'repeat': repeat}
+    return {'meta': meta, 'results': results}
+
+# Prints the ratios current / baseline of every case and returns the names of
+# the cases that regressed by more than threshold
+def compare(baseline, current, threshold=THRESHOLD):
+    regressions = []
+    print('%-44s %10s %10s %8s %8s' % ('case', 'base (ms)', 'now (ms)', 'time', 'memory'))
+    for name, now in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print('%-44s %10s %10.2f   (new)' % (name, '-', 1000 * now['time']))
+            continue
+        time_ratio = now['time'] / base['time']
+        memory_ratio = now['peak_memory'] / max(base['peak_memory'], 1)
+        slower = time_ratio > 1 + threshold and now['time'] - base['time'] > MIN_DIFF
+        regressed = slower or memory_ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print('%-44s %10.2f %10.2f %7.2fx %7.2fx%s' % (name, 1000 * base['time'], 1000 * now['time'],
+              time_ratio, memory_ratio, '  REGRESSION' if regressed else ''))
+    for name in baseline['results']:
+        if name not in current['results']:
+            print('%-44s   (missing)' % name)
+    print('%d regression(s) over %d%%' % (len(regressions), 100 * threshold))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the zoom pipeline.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the suite and write the results as JSON')
+    run_parser.add_argument('-o', '--output', help='JSON file (default: stdout)')
+    compare_parser = commands.add_parser('compare', help='compare results against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current', nargs='?', help='JSON results (default: run the suite now)')
+    compare_parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                                help='relative slowdown flagged as a regression (default %(default)s)')
+    for p in (run_parser, compare_parser):
+        p.add_argument('--lengths', type=float, nargs='+', default=LENGTHS, help='signal lengths in seconds')
+        p.add_argument('--repeat', type=int, default=REPEAT)
+        p.add_argument('-k', dest='pattern', help='only run the cases whose name contains this')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run(args.lengths, args.repeat, args.pattern)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=1)
+        else:
+            json.dump(results, sys.stdout, indent=1)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        current = run(args.lengths, args.repeat, args.pattern)
+    return 1 if compare(baseline, current, args.threshold) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
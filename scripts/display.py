@@ -1,3 +1,4 @@
+import warnings
 from matplotlib.cm import get_cmap
 from matplotlib.axes import Axes
 from matplotlib.ticker import Formatter, ScalarFormatter
@@ -145,30 +146,32 @@ def cmap(data, robust=True, cmap_seq='magma', cmap_bool='gray_r', cmap_div='cool
 
     return get_cmap(cmap_div)
 
+# Scales set by __scale_axes; on every other axis type the data maps linearly
+# to the screen
+NONLINEAR_AXES = ('mel', 'log', 'cqt', 'cqt_hz', 'cqt_note', 'tempo')
+
 def specshow(data, x_data, y_data,
              x_axis=None, y_axis=None,
              sr=22050, hop_length=512,
              fmin=None, fmax=None,
              bins_per_octave=12,
-             ax=None,
+             ax=None, raster=True, downsample=True,
              **kwargs):
+    '''Display a spectrogram with the given coordinates.
+    When both axes are linear and x_data, y_data are uniform grids (as the
+    ones of `get_axes_values`), data is drawn as an image (`imshow` with an
+    extent) instead of a `pcolormesh`, which is much faster to draw. With
+    `downsample`, data is first max-pooled down to about the size of the
+    axes in pixels.
+    Use `update_specshow` to redraw with new data.
+    '''
     
     if np.issubdtype(data.dtype, np.complexfloating):
         warnings.warn('Trying to display complex-valued input. '
                       'Showing magnitude instead.')
         data = np.abs(data)
 
-    kwargs.setdefault('cmap', cmap(data))
-    kwargs.setdefault('rasterized', True)
-    kwargs.setdefault('edgecolors', 'None')
-    kwargs.setdefault('shading', 'flat')
-
-    all_params = dict(kwargs=kwargs,
-                      sr=sr,
-                      fmin=fmin,
-                      fmax=fmax,
-                      bins_per_octave=bins_per_octave,
-                      hop_length=hop_length)
+    axes = __check_axes(ax)
 
     # Get the x and y coordinates
 #     y_coords = __mesh_coords(y_axis, y_coords, data.shape[0], **all_params)
@@ -176,12 +179,23 @@ def specshow(data, x_data, y_data,
     y_coords = y_data
     x_coords = x_data
 
-    axes = __check_axes(ax)
-    out = axes.pcolormesh(x_coords, y_coords, data, **kwargs)
+    if downsample:
+        data, x_coords, y_coords = downsample_to_axes(axes, data, x_coords, y_coords)
+
+    kwargs.setdefault('cmap', cmap(data))
+
+    if raster and is_raster(x_axis, y_axis, x_data, y_data):
+        kwargs.setdefault('interpolation', 'nearest')
+        out = axes.imshow(data, extent=data_extent(x_data, y_data), origin='lower', aspect='auto', **kwargs)
+    else:
+        kwargs.setdefault('rasterized', True)
+        kwargs.setdefault('edgecolors', 'None')
+        kwargs.setdefault('shading', 'flat')
+        out = axes.pcolormesh(x_coords, y_coords, data, **kwargs)
     __set_current_image(ax, out)
 
-    axes.set_xlim(x_coords.min(), x_coords.max())
-    axes.set_ylim(y_coords.min(), y_coords.max())
+    axes.set_xlim(x_data.min(), x_data.max())
+    axes.set_ylim(y_data.min(), y_data.max())
 
     # Set up axis scaling
     __scale_axes(axes, x_axis, 'x')
@@ -197,6 +211,79 @@ def specshow(data, x_data, y_data,
 
     return axes
 
+def update_specshow(ax, data, x_data, y_data, **kwargs):
+    '''Redraw a spectrogram shown by `specshow` on ax with new data.
+    If ax shows an image, it is reused (`set_data`); otherwise ax is cleared
+    and `specshow` is called again with kwargs.
+    Returns
+    -------
+    blit : bool
+        True if only the pixels of the image changed (same extent), so it is
+        enough to draw the image artist and blit `ax.bbox`; False if the whole
+        figure has to be redrawn.
+    '''
+
+    if not ax.images or not is_raster(None, None, x_data, y_data):
+        ax.clear()
+        specshow(data, x_data, y_data, ax=ax, **kwargs)
+        return False
+
+    image = ax.images[-1]
+    data, _, _ = downsample_to_axes(ax, data, x_data, y_data)
+    image.set_data(data)
+    image.set_cmap(cmap(data))
+    image.set_clim(data.min(), data.max())
+
+    extent = data_extent(x_data, y_data)
+    if list(image.get_extent()) == extent:
+        return True
+    image.set_extent(extent)
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+    return False
+
+def is_raster(x_axis, y_axis, x_data, y_data):
+    return (x_axis not in NONLINEAR_AXES and y_axis not in NONLINEAR_AXES
+            and is_uniform(x_data) and is_uniform(y_data))
+
+def is_uniform(coords):
+    if len(coords) < 2:
+        return False
+    steps = np.diff(coords)
+    return steps[0] != 0 and np.allclose(steps, steps[0], rtol=1e-3, atol=0)
+
+def data_extent(x_data, y_data):
+    return [float(x_data.min()), float(x_data.max()), float(y_data.min()), float(y_data.max())]
+
+def downsample_to_axes(axes, data, x_coords, y_coords):
+    '''Max-pool data by integer factors so it is not much larger than the
+    axes in pixels (peaks stay visible, unlike with decimation). Returns
+    the pooled data and the coordinates of its first row and column.
+    '''
+
+    bbox = axes.get_window_extent()
+    f_y = max(1, data.shape[0] // max(1, int(bbox.height)))
+    f_x = max(1, data.shape[1] // max(1, int(bbox.width)))
+    if f_y > 1:
+        data = max_pool(data, f_y, axis=0)
+        y_coords = y_coords[::f_y]
+    if f_x > 1:
+        data = max_pool(data, f_x, axis=1)
+        x_coords = x_coords[::f_x]
+    return data, x_coords, y_coords
+
+def max_pool(data, factor, axis):
+    '''Maximum of every `factor` consecutive rows (axis=0) or columns
+    (axis=1) of a 2-D array; the last block may be shorter.
+    '''
+
+    data = np.swapaxes(data, 0, axis)
+    n_full = data.shape[0] // factor * factor
+    pooled = data[:n_full].reshape((n_full // factor, factor) + data.shape[1:]).max(axis=1)
+    if n_full < data.shape[0]:
+        pooled = np.concatenate((pooled, data[n_full:].max(axis=0, keepdims=True)))
+    return np.swapaxes(pooled, 0, axis)
+
 def __check_axes(axes):
     '''Check if "axes" is an instance of an axis object. If not, use `gca`.'''
     if axes is None:
@@ -1,31 +1,35 @@
+import importlib
+import threading
 import tkinter as Tk
 import matplotlib
 matplotlib.use('TkAgg')
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
-import numpy as np
-import librosa.display
 import display
 import gui_util
-import stft_zoom
+import instrument
+import jobs
+import tiles
+import zoom_cache
 from tkinter.filedialog import askopenfilename
 
 def openfile(axis, figure, sr=44100):
-	global y
+	global y, path
 	path = askopenfilename(parent=root)
-	y = gui_util.load_audio(path)
-	y = y[:30*sr]
-	draw_spec(y, axis, figure)
-
-def draw_spec(y, axis, figure, sr=44100):
-	D = librosa.amplitude_to_db(np.abs(librosa.stft(y, n_fft=512)), ref=np.max)
-	x_data, y_data = gui_util.get_axes_values(sr, 0, [0, len(y)/sr], D.shape)
-	display.specshow(D, x_data, y_data, ax=axis, y_axis='log')
-	canvas = FigureCanvasTkAgg(figure, master=root)
-	canvas.show()
-	canvas.get_tk_widget().grid(row=0, columnspan=5)
+	y = gui_util.load_audio(path, sr)
+	draw_spec(tiles.open_pyramid(path, y, sr), axis, figure)
 
-def process_zoom():
+# Overview of the whole file from the tile pyramid (see tiles.py), at the level
+# that matches the size of the plot. Drawn as a raster on a linear frequency axis,
+# like the zooms, so opening another file reuses the image (see redraw)
+def draw_spec(pyramid, axis, figure, time_range=None):
+	width, height = figure.get_size_inches() * figure.dpi
+	D, x_data, y_data = pyramid.view(time_range, width=int(width), height=int(height))
+	with instrument.stage('render', D, view='overview'):
+		redraw(figure.canvas, axis, D, x_data, y_data)
+
+# Zoom parameters currently in the entries, or None if some are missing
+def zoom_params():
 
 	if not E1.get() or not E2.get() or not E3.get() or not E4.get():
 		return print('error: unspecified parameters')
@@ -54,34 +58,112 @@ def process_zoom():
 		time_res = 0 # default value: hop size defaults to n_fft // 4
 		time_res_type = 'time frames'
 
-	return(draw_spec_zoom(stft_zoom.stft_zoom(y, freq_range, time_range, 44100, freq_res_type, float(freq_res), time_res_type, float(time_res))))
+	return freq_range, time_range, freq_res_type, float(freq_res), time_res_type, float(time_res)
 
-def draw_spec_zoom(zoom):
-	D = zoom[0]
-	x = zoom[1]
-	y = zoom[2]
+# Every zoom opens its own window and is computed in the background (see jobs.py),
+# so the main window stays responsive and several zooms can run at once
+def process_zoom():
+	params = zoom_params()
+	if params:
+		start_zoom(open_zoom_window(), params)
 
+def open_zoom_window():
 	zoom_window = Tk.Toplevel(root)
 	zoom_window.wm_title("Zoom Detail")
+	window = {'toplevel': zoom_window, 'job': None, 'canvas': None, 'axes': None, 'zoom': None}
+
+	window['status'] = Tk.Label(master=zoom_window, text="queued")
+	window['status'].grid(row=1, column=0, columnspan=3)
+	cancel = Tk.Button(master=zoom_window, text="Cancel", command=lambda: cancel_zoom(window))
+	cancel.grid(row=1, column=3)
+	update = Tk.Button(master=zoom_window, text="Update", command=lambda: update_zoom(window))
+	update.grid(row=1, column=4)
+
+	def close():
+		cancel_zoom(window)
+		zoom_window.destroy()
+	zoom_window.protocol("WM_DELETE_WINDOW", close)
+	return window
+
+# Recomputes the zoom of a window with the parameters now in the entries; a zoom
+# still running in it is superseded (cancelled)
+def update_zoom(window):
+	params = zoom_params()
+	if params:
+		start_zoom(window, params)
+
+def start_zoom(window, params):
+	cancel_zoom(window)
+	freq_range, time_range = params[:2]
+	window['toplevel'].wm_title("Zoom Detail: %g-%g Hz, %g-%g s" % (tuple(freq_range) + tuple(time_range)))
+	window['status'].config(text="queued")
+	window['job'] = pool.submit(progressive_zoom, y, freq_range, time_range, 44100, *params[2:], file_id=path,
+		on_progress=lambda job: window['status'].config(text="%s (%d%%)" % (job.stage, 100 * job.progress)),
+		on_partial=lambda job, zoom: draw_spec_zoom(zoom, window, "preview"),
+		on_done=lambda job, zoom: draw_spec_zoom(zoom, window),
+		on_error=lambda job, error: window['status'].config(text="error: %s" % error))
+
+# Runs on a worker: a cheap preview is shown first, and replaced in the same figure by
+# the full result (see zoom_cache.ZoomCache.zoom_progressive)
+def progressive_zoom(*args, progress, **kwargs):
+	zoom = None
+	for zoom in zooms.zoom_progressive(*args, progress=progress, **kwargs):
+		progress(0.0, 'computing', zoom)
+	return zoom
+
+def cancel_zoom(window):
+	if window['job'] is not None and not window['job'].finished():
+		window['job'].cancel()
+		window['status'].config(text="cancelled")
+
+def draw_spec_zoom(zoom, window, status="done"):
+	window['status'].config(text=status)
+	if zoom is window['zoom']: # already drawn as a partial result
+		return
+	window['zoom'] = zoom
 
-	f = Figure()
-	a = f.add_subplot(111)
-
-	display.specshow(D, x, y, ax=a)
+	D = zoom[0]
+	x = zoom[1]
+	y = zoom[2]
 
-	canvas = FigureCanvasTkAgg(f, master=zoom_window)
-	canvas.show()
-	canvas.get_tk_widget().grid(row=0, columnspan=5)
+	with instrument.stage('render', D, view='zoom', status=status):
+		if window['canvas'] is None:
+			f = Figure()
+			window['canvas'] = FigureCanvasTkAgg(f, master=window['toplevel'])
+			window['canvas'].get_tk_widget().grid(row=0, columnspan=5)
+			window['axes'] = f.add_subplot(111)
+			display.specshow(D, x, y, ax=window['axes'])
+			window['canvas'].show()
+		else:
+			redraw(window['canvas'], window['axes'], D, x, y)
+
+# Updates the spectrogram already on axis (same canvas, figure and artist, see
+# display.update_specshow); when its extent did not change, only the image is
+# drawn again and blitted
+def redraw(canvas, axis, D, x, y):
+	if display.update_specshow(axis, D, x, y):
+		axis.draw_artist(axis.images[-1])
+		canvas.blit(axis.bbox)
+	else:
+		canvas.show()
+
+zooms = zoom_cache.ZoomCache() # repeated zooms (or zooms inside a previous one) skip the computation
+pool = jobs.JobPool() # zooms are computed here, off the Tk main loop
 
 root = Tk.Tk()
 root.wm_title("STFT Zoom Tool")
+jobs.poll_tk(root, pool)
+
+# scipy.signal (filter design and filtering, only needed by the zooms) takes longer to
+# import than everything else; it is loaded in the background while a file is opened
+threading.Thread(target=importlib.import_module, args=('scipy.signal',), daemon=True).start()
 
 # Top menu for opening files
 menubar = Tk.Menu(root)
 filemenu = Tk.Menu(menubar, tearoff=0)
 filemenu.add_command(label="Open", command= lambda: openfile(a, f))
 filemenu.add_separator()
-filemenu.add_command(label="Exit", command=root.quit)
+filemenu.add_command(label="Exit", command=lambda: (pool.shutdown(), root.quit()))
 menubar.add_cascade(label="File", menu=filemenu)
 root.config(menu=menubar)
 
@@ -1,5 +1,6 @@
 import numpy as np
-import librosa
+import audio_store
+import stft_zoom
 
 def get_axes_values(sr, f_min, time_range, spec_shape):
     x_axis = np.linspace(time_range[0], time_range[1], spec_shape[1])
@@ -7,17 +8,25 @@ def get_axes_values(sr, f_min, time_range, spec_shape):
     y_axis = np.linspace(f_min, f_max, spec_shape[0])
     return x_axis, y_axis
 
-def get_audio(path):
-	y, sr = librosa.load(path, sr=44100)
-	return y[:sr*30]
+def get_audio(path, sr=44100):
+	return load_audio(path, sr)[:sr*30]
 
-def load_audio(path):
-	y, sr = librosa.load(path, sr=44100)
-	return y
+# Memory-mapped view of the decoded signal (see audio_store): only the parts
+# that are sliced are read from disk
+def load_audio(path, sr=44100):
+	return audio_store.open_audio(path, sr)
+
+# Reads the file in blocks of block_length samples at its own sample rate, without
+# decoding it all at once (see stft_zoom.stft_zoom_stream). Returns (blocks, sr).
+def stream_audio(path, block_length=65536):
+	import soundfile
+	sr = soundfile.info(path).samplerate
+	blocks = (block.mean(axis=1) for block in soundfile.blocks(path, blocksize=block_length, dtype='float32', always_2d=True))
+	return blocks, sr
 
 def get_spectrogram(y, sr=44100):
 	t_final = len(y)/sr
-	D = librosa.amplitude_to_db(np.abs(librosa.stft(y, n_fft=512)), ref=np.max)
+	D = stft_zoom.stft_db(y, 512, 128)
 	return D, get_axes_values(sr, 0, [0, t_final], D.shape)
 
 def fft_frequencies(sr=22050, n_fft=2048):
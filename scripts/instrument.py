@@ -0,0 +1,147 @@
+import itertools
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# Structured instrumentation of the zoom pipeline. Every stage (slice, filter
+# design, filtering, modulation, subsampling, stft, db, unmirror, render) runs
+# inside a stage() block, which records its wall time, the number of input and
+# output samples and the size of the arrays it produced. Stages nest (e.g. all
+# stages of one zoom run inside its 'zoom' stage), and every record has the id
+# of its parent, so the records of one request can be put back together.
+#
+# Off by default, and then stage() just returns a shared no-op object. It is
+# turned on with enable(), or for the whole process by setting the
+# STFT_ZOOM_TRACE environment variable to the path of a JSON lines file:
+#
+#   instrument.enable()
+#   stft_zoom.stft_zoom(...)
+#   instrument.export('zoom.jsonl')  # or instrument.records()
+
+enabled = False
+_records = []
+_sink = None
+_ids = itertools.count(1)
+_local = threading.local() # stack of the open stages of each thread
+_lock = threading.Lock()
+
+class Stage:
+    def __init__(self, name, y, info):
+        self.record = dict(info, stage=name)
+        if y is not None and np.ndim(y) == 1:
+            self.record['n_in'] = len(y)
+        elif y is not None:
+            self.record['in_shape'] = list(np.shape(y))
+
+    def __enter__(self):
+        stack = _stack()
+        self.record['id'] = next(_ids)
+        self.record['parent'] = stack[-1].record['id'] if stack else None
+        self.record['thread'] = threading.current_thread().name
+        self.record['start'] = time.time()
+        stack.append(self)
+        self._t0 = time.perf_counter()
+        return self
+
+    # Arrays produced by the stage: the first one gives n_out (or shape, if it
+    # is not 1-D), all of them add to nbytes. Returns them as given (one array,
+    # or a tuple of them).
+    def output(self, *arrays):
+        first = arrays[0]
+        if np.ndim(first) == 1:
+            self.record['n_out'] = len(first)
+        else:
+            self.record['shape'] = list(np.shape(first))
+        self.record['nbytes'] = self.record.get('nbytes', 0) + sum(getattr(a, 'nbytes', 0) for a in arrays)
+        return first if len(arrays) == 1 else arrays
+
+    # Extra information about the stage (e.g. the strategy that was chosen)
+    def set(self, **info):
+        self.record.update(info)
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record['time'] = time.perf_counter() - self._t0
+        if exc_type is not None:
+            self.record['error'] = exc_type.__name__
+        _stack().pop()
+        _emit(self.record)
+        return False
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def output(self, *arrays):
+        return arrays[0] if len(arrays) == 1 else arrays
+
+    def set(self, **info):
+        pass
+
+NULL_STAGE = NullStage()
+
+# with instrument.stage('filtering', y, strategy=...) as s: ... s.output(y_filt)
+# y (optional) is the input of the stage, for n_in (or in_shape)
+def stage(name, y=None, **info):
+    if not enabled:
+        return NULL_STAGE
+    return Stage(name, y, info)
+
+# Starts recording. With a path, the records are appended to it as JSON lines
+# as soon as each stage ends (and not kept in memory).
+def enable(path=None):
+    global enabled, _sink
+    disable()
+    if path is not None:
+        _sink = open(path, 'a', buffering=1)
+    enabled = True
+
+def disable():
+    global enabled, _sink
+    enabled = False
+    if _sink is not None:
+        _sink.close()
+        _sink = None
+
+def records():
+    with _lock:
+        return list(_records)
+
+def clear():
+    with _lock:
+        del _records[:]
+
+# Writes the records kept in memory to path as JSON lines
+def export(path):
+    with open(path, 'w') as f:
+        for record in records():
+            f.write(to_json(record) + '\n')
+
+def to_json(record):
+    return json.dumps(record, default=_plain)
+
+def _plain(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def _emit(record):
+    with _lock:
+        if _sink is not None:
+            _sink.write(to_json(record) + '\n')
+        else:
+            _records.append(record)
+
+if os.environ.get('STFT_ZOOM_TRACE'):
+    enable(os.environ['STFT_ZOOM_TRACE'])
@@ -0,0 +1,131 @@
+import concurrent.futures
+import os
+import threading
+import stft_zoom
+
+# Background execution of zoom jobs for the GUI. Jobs run on a pool of worker
+# threads (the filtering and the FFTs release the GIL, so several zooms do
+# compute at the same time); the Tk main loop polls the pool with after()
+# (see poll_tk), so progress and results are always handled on the main
+# thread and the window never blocks.
+#
+# Cancelling is cooperative: a job that has not started yet is just dropped,
+# a running one stops at its next progress report (see Job.report).
+
+POOL_SIZE = max(1, min(4, (os.cpu_count() or 1) - 1))
+POLL_INTERVAL = 50 # ms
+
+class Cancelled(Exception):
+    pass
+
+class Job:
+    def __init__(self, fn, args, kwargs, on_done=None, on_progress=None, on_error=None, on_partial=None):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.on_partial = on_partial
+        self.state = 'queued' # running, done, failed or cancelled
+        self.progress = 0.0
+        self.stage = 'queued'
+        self.result = None
+        self.partial = None # latest intermediate result (see report)
+        self.partial_count = 0
+        self._partial_delivered = 0
+        self.error = None
+        self.future = None
+        self._cancel = threading.Event()
+
+    # Called by fn (it is passed as its progress argument) between stages of
+    # the computation, optionally with an intermediate result (e.g. a preview
+    # of the final one). Raises Cancelled if the job was cancelled meanwhile.
+    def report(self, progress, stage, partial=None):
+        if self._cancel.is_set():
+            raise Cancelled()
+        self.progress = progress
+        self.stage = stage
+        if partial is not None:
+            self.partial = partial
+            self.partial_count += 1
+
+    def cancel(self):
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            self.state = 'cancelled'
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def finished(self):
+        return self.state in ('done', 'failed', 'cancelled')
+
+    def run(self):
+        self.state = 'running'
+        try:
+            self.report(0.0, 'running')
+            self.result = self.fn(*self.args, progress=self.report, **self.kwargs)
+            self.state = 'cancelled' if self.cancelled() else 'done'
+        except Cancelled:
+            self.state = 'cancelled'
+        except Exception as error:
+            self.error = error
+            self.state = 'failed'
+
+# Several zooms run at once on a pool of worker threads, so their FFTs share
+# the CPUs (stft_zoom.FFT_WORKERS threads each) instead of each asking for all
+# of them. Only ever lowers FFT_WORKERS (e.g. set by STFT_ZOOM_FFT_WORKERS).
+def share_fft_workers(workers):
+    stft_zoom.FFT_WORKERS = min(stft_zoom.FFT_WORKERS, max(1, (os.cpu_count() or 1) // workers))
+
+class JobPool:
+    def __init__(self, workers=POOL_SIZE):
+        share_fft_workers(workers)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.jobs = []
+
+    # Runs fn(*args, progress=job.report, **kwargs) on a worker. The callbacks
+    # are called from poll (so on the thread that polls): on_progress(job)
+    # while it runs, on_partial(job, partial) when it reports an intermediate
+    # result (only the latest one, if several were reported since the last
+    # poll), then on_done(job, result) or on_error(job, error). Cancelled jobs
+    # call neither, even if they finished before the cancel.
+    def submit(self, fn, *args, on_done=None, on_progress=None, on_error=None, on_partial=None, **kwargs):
+        job = Job(fn, args, kwargs, on_done, on_progress, on_error, on_partial)
+        job.future = self.executor.submit(job.run)
+        self.jobs.append(job)
+        return job
+
+    # Delivers progress and results of the jobs that changed since the last
+    # poll. Returns the number of jobs still queued or running.
+    def poll(self):
+        pending = []
+        for job in self.jobs:
+            if not job.finished():
+                pending.append(job)
+                if job.state != 'running' or job.cancelled():
+                    continue
+                if job.on_partial is not None and job.partial_count > job._partial_delivered:
+                    job._partial_delivered = job.partial_count
+                    job.on_partial(job, job.partial)
+                if job.on_progress is not None:
+                    job.on_progress(job)
+            elif job.cancelled():
+                continue
+            elif job.state == 'done' and job.on_done is not None:
+                job.on_done(job, job.result)
+            elif job.state == 'failed' and job.on_error is not None:
+                job.on_error(job, job.error)
+        self.jobs = pending
+        return len(pending)
+
+    def shutdown(self):
+        for job in self.jobs:
+            job.cancel()
+        self.executor.shutdown(wait=False)
+
+# Polls pool every interval ms from the Tk main loop of root
+def poll_tk(root, pool, interval=POLL_INTERVAL):
+    pool.poll()
+    root.after(interval, poll_tk, root, pool, interval)
@@ -0,0 +1,179 @@
+import functools
+import numpy as np
+import scipy # scipy.signal is loaded on first use (see gui.py)
+import instrument
+
+# Multirate (filter + decimate in one step) engine used by stft_zoom.
+#
+# Every stage is a linear phase FIR run through scipy.signal.upfirdn, which is
+# a polyphase implementation: only the output samples that survive the
+# decimation are ever computed. Long decimations are split into several cheap
+# stages (largest factor first), so the only sharp filter runs at the lowest
+# rate. Band-pass zooms are handled by mixing the band down to 0 Hz with a
+# complex oscillator and decimating the (complex) baseband signal; the real
+# signal the original strategies would have produced is then rebuilt at the
+# low rate by mixing the baseband back to where the band lands after the
+# decimation.
+
+MAX_STAGE_FACTOR = 8
+DESIGN_CACHE_SIZE = 128
+
+def prime_factors(n):
+    factors = []
+    p = 2
+    while p * p <= n:
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+        p += 1
+    if n > 1:
+        factors.append(n)
+    return factors
+
+# Splits a decimation factor into per-stage factors, largest first
+def stage_factors(step, max_factor=MAX_STAGE_FACTOR):
+    stages = []
+    for p in sorted(prime_factors(step), reverse=True):
+        if stages and stages[-1] * p <= max_factor:
+            stages[-1] *= p
+        else:
+            stages.append(p)
+    return sorted(stages, reverse=True)
+
+# Largest decimation factor <= step that only has prime factors <= max_prime.
+# Used where the output rate only needs to be *at least* sr/step, so a step
+# that can be split in stages is preferable to a large prime one.
+def smooth_step(step, max_prime=7):
+    for candidate in range(step, 0, -1):
+        if max(prime_factors(candidate) or [1]) <= max_prime:
+            return candidate
+    return 1
+
+def design_lowpass_fir(f_pass, f_stop, fs, atten):
+    numtaps, beta = scipy.signal.kaiserord(atten, (f_stop - f_pass) / (fs/2))
+    # odd length, so the group delay is a whole number of samples
+    return scipy.signal.firwin(numtaps | 1, (f_pass + f_stop) / 2, window=('kaiser', beta), fs=fs)
+
+# Returns a tuple of (decimation factor, fir taps) that brings the rate from
+# sr to sr/step keeping [0, f_pass] and rejecting everything above f_stop
+# (f_stop must not be above the final Nyquist frequency). Designs are cached
+# (LRU) and shared between calls, so the taps must not be modified.
+def design_lowpass_stages(sr, step, f_pass, f_stop, atten=80):
+    with instrument.stage('filter design', filter='multirate', step=step) as stage:
+        stages = _design_lowpass_stages(float(sr), int(step), float(f_pass), float(f_stop), float(atten))
+        stage.set(factors=[factor for factor, _ in stages], taps=[len(h) for _, h in stages])
+        return stages
+
+@functools.lru_cache(maxsize=DESIGN_CACHE_SIZE)
+def _design_lowpass_stages(sr, step, f_pass, f_stop, atten):
+    return tuple((factor, design_lowpass_fir(f_pass, stop, fs, atten))
+                 for factor, fs, stop in stage_specs(sr, step, f_stop))
+
+# (decimation factor, input rate, stop frequency) of every stage
+def stage_specs(sr, step, f_stop):
+    specs = []
+    fs = sr
+    factors = stage_factors(step)
+    for i, factor in enumerate(factors):
+        fs_out = fs / factor
+        if i == len(factors) - 1:
+            stop = f_stop
+        else:
+            # intermediate stages only have to protect what the next stages
+            # keep, so the band between f_stop and fs_out - f_stop is free
+            stop = fs_out - f_stop
+        specs.append((factor, fs, stop))
+        fs = fs_out
+    return specs
+
+# Same stages as design_lowpass_stages, as (decimation factor, number of taps),
+# without designing the filters (used for cost estimates)
+def stage_taps(sr, step, f_pass, f_stop, atten=80):
+    return [(factor, scipy.signal.kaiserord(atten, (stop - f_pass) / (fs/2))[0] | 1)
+            for factor, fs, stop in stage_specs(sr, step, f_stop)]
+
+# Stages for bandpass_baseband: the band is mixed down by its centre f_c and
+# then low-passed to half its width. Returns (f_c, stages).
+def design_bandpass_stages(sr, step, wp, ws, atten=60):
+    f_c, half_pass, half_stop = baseband_edges(wp, ws)
+    return f_c, design_lowpass_stages(sr, step, half_pass, half_stop, atten)
+
+def bandpass_stage_taps(sr, step, wp, ws, atten=60):
+    _, half_pass, half_stop = baseband_edges(wp, ws)
+    return stage_taps(sr, step, half_pass, half_stop, atten)
+
+# Centre of the band, and pass and stop edges of the baseband low-pass
+def baseband_edges(wp, ws):
+    half_pass = (wp[1] - wp[0]) / 2
+    return (wp[0] + wp[1]) / 2, half_pass, half_pass + min(wp[0] - ws[0], ws[1] - wp[1])
+
+# Past this many taps per output sample, running the whole convolution through
+# overlap-add FFTs (and discarding the samples the decimation drops) is cheaper
+# than the direct polyphase sums of upfirdn
+POLYPHASE_MAX_TAPS = 16
+
+# Zero phase FIR + decimation: output n lines up with input n*factor, just as
+# y[::factor] would
+def fir_decimate(y, h, factor):
+    oa = len(h) > POLYPHASE_MAX_TAPS * factor
+    with instrument.stage('filtering', y, filter='fir', factor=factor, taps=len(h),
+                          method='oaconvolve' if oa else 'upfirdn') as stage:
+        return stage.output(_fir_decimate(y, h, factor, oa))
+
+def _fir_decimate(y, h, factor, oa):
+    delay = (len(h) - 1) // 2
+    n_out = -(-len(y) // factor)
+    if oa:
+        return scipy.signal.oaconvolve(y, h)[delay : delay + len(y) : factor]
+    # delaying h (not y, which is much longer) by pad samples makes the first
+    # kept output fall on one of the outputs upfirdn computes
+    pad = -delay % factor
+    start = (delay + pad) // factor
+    return scipy.signal.upfirdn(np.concatenate((np.zeros(pad, h.dtype), h)), y, down=factor)[start : start + n_out]
+
+# The taps are cast to the precision of y, so float32 (complex64) signals stay
+# in single precision
+def apply_stages(y, stages):
+    for factor, h in stages:
+        y = fir_decimate(y, h.astype(y.real.dtype, copy=False), factor)
+    return y
+
+# Complex exponential exp(1j*2*pi*freq*n/sr + 1j*phase), n = 0..length-1.
+# Built from a one block table and a per-block rotation instead of one
+# exp/cos per sample.
+def oscillator(length, freq, sr, phase=0, block=1024, dtype=np.complex128):
+    w = 2*np.pi*freq/sr
+    n_blocks = -(-length // block)
+    table = np.exp(1j * w * np.arange(block)).astype(dtype)
+    rotation = np.exp(1j * (w * block * np.arange(n_blocks) + phase)).astype(dtype)
+    return np.outer(rotation, table).ravel()[:length]
+
+# Phase of an oscillator of freq Hz at sample n (phase 0 at sample 0), reduced
+# to one turn so it stays exact for large n
+def phase_at(n, freq, sr):
+    return 2*np.pi * ((freq * n / sr) % 1)
+
+def lowpass_decimate(y, step, f_pass, f_stop, sr, atten=80):
+    return apply_stages(y, design_lowpass_stages(sr, step, f_pass, f_stop, atten))
+
+# Band-pass filters y to wp (Hz), rejecting everything outside of ws (Hz), and
+# decimates it by step. Returns the complex baseband signal (band centre
+# mixed down to 0 Hz) at rate sr/step, together with the centre frequency.
+# n0 is the index of y[0] in the signal it was sliced from: slices of the
+# same signal processed separately are mixed with the same phase.
+def bandpass_baseband(y, step, wp, ws, sr, atten=60, n0=0):
+    f_c, stages = design_bandpass_stages(sr, step, wp, ws, atten)
+    with instrument.stage('modulation', y, freq=-f_c) as stage:
+        y_mix = stage.output(y * oscillator(len(y), -f_c, sr, phase=phase_at(n0, -f_c, sr),
+                                            dtype=np.result_type(y.dtype, np.complex64)))
+    return apply_stages(y_mix, stages), f_c
+
+# Real signal at rate sr/step equal to band-passing y to wp and then shifting
+# the band down by shift Hz (ring modulation) before taking one of every step
+# samples. shift=0 is plain band-pass sampling (undersampling). n0 as in
+# bandpass_baseband.
+def bandpass_decimate(y, step, wp, ws, sr, shift=0, atten=60, n0=0):
+    z, f_c = bandpass_baseband(y, step, wp, ws, sr, atten, n0)
+    with instrument.stage('modulation', z, freq=f_c - shift) as stage:
+        z *= oscillator(len(z), f_c - shift, sr/step, phase=phase_at(n0, f_c - shift, sr), dtype=z.dtype) # z is ours
+        return stage.output(np.multiply(z.real, 2))
@@ -0,0 +1,165 @@
+import numpy as np
+import scipy
+import instrument
+import multirate
+import stft_zoom
+
+# Incremental zoom of a fixed band while the time window pans (see
+# PanSession). Each pan only filters the input and computes the STFT frames
+# of the edge that entered the window; frames that stay in the window are
+# reused and the ones that leave it are dropped, so the cost of a pan is
+# proportional to the distance moved instead of to the window length.
+#
+#   session = pan.PanSession(y, (5000, 5500), 44100, 'freq. bins', 40, 'time frames', 0)
+#   D, x_axis, y_axis = session.zoom([10, 20])
+#   D, x_axis, y_axis = session.zoom([11, 21]) # filters ~1 s, not 10 s
+#
+# It follows the original path of stft_zoom (filter_and_mod with the IIR
+# filters at the full rate, then y[::step]), because the IIR state can be
+# carried over: panning forward continues the filters exactly where the last
+# pan stopped. Panning back (or forward after a pan back) has no state to
+# continue from, so the new edge is filtered after warmup seconds of signal,
+# as stft_zoom does. Frames sit on a fixed hop grid anchored at the start of
+# the first window, so every frame is computed only once while it stays in
+# the window.
+#
+# Differences from stft_zoom: frames at the edges of the window see the
+# signal around them instead of zero padding, the x axis has the exact times
+# of the frame centres, and the dB are relative to the maximum of the
+# current window.
+
+AMIN = 1e-5
+TOP_DB = 80.0
+
+class PanSession:
+    def __init__(self, y, freq_range, sr, freq_res_type, freq_res, time_res_type, time_res, warmup=stft_zoom.WARMUP):
+        self.y = y
+        self.freq_range = freq_range
+        self.sr = sr
+        self.res = (freq_res_type, freq_res, time_res_type, time_res)
+        self.warmup = warmup
+
+        self.plan = stft_zoom.zoom_plan(freq_range, sr)
+        self.step = stft_zoom.subsample_step(self.plan['new_sr'], sr)
+        self.new_sr = sr / self.step
+        strategy = self.plan['strategy']
+        if strategy == 'lowpass':
+            self.filters = [stft_zoom.design_lowpass(self.plan['lp_cutoff'], sr)]
+        else:
+            self.filters = [stft_zoom.design_bandpass(self.plan['wp'], self.plan['ws'], sr)]
+        self.mod_freq = self.plan['mod_freq'] if strategy in ('ring mod', 'ring mod + lpf') else None
+        if strategy == 'ring mod + lpf':
+            self.filters.append(stft_zoom.design_lowpass(self.plan['lp_cutoff'], sr)) # after the modulation
+
+        self.width = None # samples (at sr) of the window
+        self.filtered_samples = 0 # input samples filtered, over all pans
+        self.computed_frames = 0
+
+    # Same result as stft_zoom.stft_zoom (original path) for the band of the
+    # session and time_range (see the differences above)
+    def zoom(self, time_range):
+        n_start = int(self.sr * time_range[0])
+        width = int(round(self.sr * (time_range[1] - time_range[0]))) # not affected by where the window is
+        with instrument.stage('zoom', freq_range=list(self.freq_range), time_range=list(time_range), sr=self.sr,
+                              res=list(self.res), session='pan', strategy=self.plan['strategy']) as stage:
+            filtered, computed = self.filtered_samples, self.computed_frames
+            if width != self.width:
+                self._reset(n_start, width)
+            k_first = -(-(n_start - self.origin) // (self.step * self.hop))
+            if self.k_hi > self.k_lo and not (self.k_lo - self.n_frames < k_first < self.k_hi):
+                self._reset(n_start, width) # no overlap with the current window
+                k_first = 0
+            self._pan(k_first)
+            stage.set(filtered=self.filtered_samples - filtered, new_frames=self.computed_frames - computed)
+
+            ref_db = self.frames_db.max()
+            D = np.maximum(self.frames_db - ref_db, -TOP_DB)
+            t_first, t_last = (self.origin + np.array([self.k_lo, self.k_hi - 1]) * self.hop * self.step) / self.sr
+            return stage.output(*stft_zoom.zoom_axes(D, self.new_sr, self.plan['f_min'], [t_first, t_last]))
+
+    # New window of width samples starting at n_start: everything is computed again
+    def _reset(self, n_start, width):
+        self.width = width
+        self.origin = n_start
+        n_sub = -(-width // self.step) # len(y[n_start:n_start + width][::step])
+        self.n_fft, self.hop = stft_zoom.stft_params(n_sub, self.freq_range, self.new_sr, *self.res)
+        self.n_frames = 1 + (n_sub + 2*(self.n_fft // 2) - self.n_fft) // self.hop # as stft_zoom.stft
+        self.window = stft_zoom.hann(self.n_fft, stft_zoom.DTYPE)
+        self.z = np.zeros(0, dtype=stft_zoom.DTYPE) # filtered and decimated signal
+        self.z_lo = 0 # index (at new_sr, from origin) of z[0]
+        self.zi = None # filter state at input sample n_right, if z ends there
+        self.n_right = None
+        self.frames_db = np.zeros((self.n_fft // 2 + 1, 0), dtype=stft_zoom.DTYPE)
+        self.k_lo = self.k_hi = 0 # frames k_lo..k_hi-1 are in frames_db
+
+    # Moves the window to frames k_first..k_first+n_frames-1 (frame k is centred
+    # on decimated sample k*hop)
+    def _pan(self, k_first):
+        k_last = k_first + self.n_frames # exclusive
+        need_lo = k_first * self.hop - self.n_fft // 2
+        need_hi = (k_last - 1) * self.hop - self.n_fft // 2 + self.n_fft
+        z_hi = self.z_lo + len(self.z)
+
+        if len(self.z) == 0:
+            self.z, self.zi, self.n_right = self._filter(need_lo, need_hi, None)
+            self.z_lo = need_lo
+        else:
+            if need_lo < self.z_lo:
+                left, _, _ = self._filter(need_lo, self.z_lo, None)
+                self.z = np.concatenate((left, self.z))
+                self.z_lo = need_lo
+            if need_hi > z_hi:
+                right, self.zi, self.n_right = self._filter(z_hi, need_hi, self.zi, self.n_right)
+                self.z = np.concatenate((self.z, right))
+            elif need_hi < z_hi:
+                self.zi = self.n_right = None # the state no longer matches the end of z
+            self.z = self.z[need_lo - self.z_lo : need_hi - self.z_lo]
+            self.z_lo = need_lo
+
+        keep = self.frames_db[:, max(k_first - self.k_lo, 0) : max(k_last - self.k_lo, 0)]
+        left = self._frames(k_first, min(self.k_lo, k_last)) if k_first < self.k_lo else None
+        right = self._frames(max(self.k_hi, k_first), k_last) if k_last > self.k_hi else None
+        self.frames_db = np.hstack([part for part in (left, keep, right) if part is not None])
+        self.k_lo, self.k_hi = k_first, k_last
+
+    # STFT frames k_a..k_b-1 in dB (not yet relative to the maximum), from z
+    def _frames(self, k_a, k_b):
+        start = k_a * self.hop - self.n_fft // 2 - self.z_lo
+        frames = np.lib.stride_tricks.sliding_window_view(self.z, self.n_fft)[start :: self.hop][: k_b - k_a]
+        S = np.abs(scipy.fft.rfft(frames * self.window, axis=1, workers=stft_zoom.FFT_WORKERS)).T
+        np.maximum(S, AMIN, out=S)
+        np.log10(S, out=S)
+        S *= 20
+        self.computed_frames += k_b - k_a
+        return S
+
+    # Decimated samples m_a..m_b-1 (sample m is input sample origin + m*step).
+    # With zi (the filter state at input sample n_right), filtering continues
+    # from there; without it, it starts warmup seconds before m_a. Returns the
+    # samples, the filter state after them and the input sample it is at.
+    def _filter(self, m_a, m_b, zi, n_right=None):
+        n_a = self.origin + m_a * self.step
+        n_b = self.origin + (m_b - 1) * self.step + 1
+        if zi is None:
+            start = n_a - min(int(self.sr * self.warmup), max(n_a, 0))
+            zi = [np.zeros((sos.shape[0], 2)) for sos in self.filters]
+        else:
+            start = n_right
+        x = self._input(start, n_b)
+        zi = list(zi)
+        x, zi[0] = scipy.signal.sosfilt(self.filters[0], x, zi=zi[0])
+        if self.mod_freq is not None:
+            phase = 2*np.pi*self.mod_freq*start/self.sr
+            x *= np.real(multirate.oscillator(len(x), self.mod_freq, self.sr, phase=phase))
+        if len(self.filters) > 1:
+            x, zi[1] = scipy.signal.sosfilt(self.filters[1], x, zi=zi[1])
+        self.filtered_samples += n_b - start
+        return x[n_a - start :: self.step].astype(stft_zoom.DTYPE), zi, n_b
+
+    # Input samples n_a..n_b-1, zero outside of the signal
+    def _input(self, n_a, n_b):
+        x = np.zeros(n_b - n_a)
+        lo, hi = max(n_a, 0), min(n_b, len(self.y))
+        if lo < hi:
+            x[lo - n_a : hi - n_a] = self.y[lo:hi]
+        return x
@@ -0,0 +1,163 @@
+import concurrent.futures
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import scipy
+import instrument
+import stft_zoom
+
+# Parallel stft_zoom for wide or long zooms, on a pool of processes. The
+# signal is copied once into shared memory (see ParallelZoom.share); every
+# task maps it and reads only its own part, so the audio is never pickled.
+#
+#   with parallel.ParallelZoom(workers=8) as executor:
+#       D, x_axis, y_axis = executor.zoom(y, (0, 8000), [0, 600], 44100, 'freq. bins', 400, 'time frames', 0)
+#
+# The STFT frames of the zoom are split in time into contiguous segments,
+# one per task. A segment filters and decimates only the samples its frames
+# cover, plus overlap seconds of signal before them for the filters to settle
+# and, on the fused path, after them for the look-ahead of the zero-phase
+# FIRs. The first segment starts like the serial path, warmup seconds before
+# time_range. The modulations keep the
+# phase of the serial path (the n0 argument of stft_zoom._filter_and_mod and
+# _filter_and_decimate), so the magnitudes of the segments are the frames of
+# the serial result and are just put side by side; the dB conversion, which
+# is relative to the maximum of the whole result, is done on the joined
+# magnitude. The first segment is exactly the serial computation; the others
+# differ only by what is left of the filter transients after overlap
+# seconds, which is longer than stft_zoom.WARMUP: the narrow elliptic
+# low-passes of the original path still ring after 0.1 s (up to 0.8 dB at
+# every seam), much less after SEGMENT_OVERLAP. See bench_parallel.py.
+#
+# Only the filter paths (fused or not) run in parallel; quadrature and the
+# czt backend fall back to stft_zoom.
+
+SEGMENT_OVERLAP = 0.5 # seconds
+MIN_SEGMENT = 5.0 # seconds of signal per segment, at least (each one filters overlap seconds more)
+MIN_SEGMENT_FRAMES = 16
+
+class ParallelZoom:
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        self._shared = {} # id(y) -> (y, shared memory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+    # Copies y into shared memory, once: later zooms of the same array reuse it,
+    # so y must not be modified while it is shared (see release)
+    def share(self, y):
+        if id(y) not in self._shared:
+            y = np.asarray(y)
+            shm = shared_memory.SharedMemory(create=True, size=max(y.nbytes, 1))
+            np.ndarray(y.shape, y.dtype, buffer=shm.buf)[:] = y
+            self._shared[id(y)] = (y, shm)
+        return self._shared[id(y)][1]
+
+    def release(self, y):
+        _, shm = self._shared.pop(id(y), (None, None))
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    def shutdown(self):
+        self.executor.shutdown()
+        for _, shm in self._shared.values():
+            shm.close()
+            shm.unlink()
+        self._shared.clear()
+
+    # Same parameters and result as stft_zoom.stft_zoom. segments: number of
+    # tasks (by default one per worker, fewer for short zooms).
+    def zoom(self, y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res, fused=True,
+             quadrature=False, warmup=stft_zoom.WARMUP, backend='filter', plan=None, segments=None,
+             overlap=SEGMENT_OVERLAP):
+        res = (freq_res_type, freq_res, time_res_type, time_res)
+        if backend != 'filter' or (quadrature and freq_range[0] > 200):
+            return stft_zoom.stft_zoom(y, freq_range, time_range, sr, *res, fused=fused, quadrature=quadrature,
+                                       warmup=warmup, backend=backend, plan=plan)
+        if plan is None:
+            plan = stft_zoom.zoom_plan(freq_range, sr)
+
+        geometry = zoom_geometry(len(y), freq_range, time_range, sr, res, plan, fused, warmup)
+        n_start, n_end, step, n_sub, n_fft, hop = geometry
+        n_frames = 1 + (n_sub + 2*(n_fft // 2) - n_fft) // hop # as stft_zoom.stft
+        if segments is None:
+            segments = min(self.workers, (n_end - n_start) // int(sr * MIN_SEGMENT), n_frames // MIN_SEGMENT_FRAMES)
+        bounds = np.linspace(0, n_frames, max(segments, 1) + 1).astype(int)
+
+        with instrument.stage('zoom', freq_range=list(freq_range), time_range=list(time_range), sr=sr, res=list(res),
+                              fused=fused, strategy=plan['strategy'], workers=self.workers, segments=len(bounds) - 1) as stage:
+            shm = self.share(y)
+            signal = (shm.name, np.shape(y), np.asarray(y).dtype.str)
+            futures = [self.executor.submit(segment_magnitude, signal, geometry, k_a, k_b, freq_range, sr, plan,
+                                            fused, warmup, overlap, np.dtype(stft_zoom.DTYPE).str)
+                       for k_a, k_b in zip(bounds[:-1], bounds[1:])]
+            S = np.hstack([future.result() for future in futures])
+            D = stft_zoom.magnitude_to_db(S, out=S)
+            return stage.output(*stft_zoom.zoom_axes(D, sr / step, plan['f_min'], time_range))
+
+# Where the serial path (stft_zoom.zoom_signal + analyze_slice) puts things:
+# first and last input samples of time_range (decimated sample m is input
+# sample n_start + m*step), decimation step, number of decimated samples and
+# the window and hop of the STFT
+def zoom_geometry(n, freq_range, time_range, sr, res, plan, fused, warmup):
+    n_start = int(sr * time_range[0])
+    n_end = min(int(sr * time_range[1]), n)
+    step = stft_zoom.fused_step(plan, sr) if fused else stft_zoom.subsample_step(plan['new_sr'], sr)
+    n_sub = -(-(n_end - n_start) // step)
+    n_fft, hop = stft_zoom.stft_params(n_sub, freq_range, sr / step, *res)
+    return n_start, n_end, step, n_sub, n_fft, hop
+
+# Shared memory segments this worker process has already mapped, by name
+_attached = {}
+
+def attach(name, shape, dtype):
+    if name not in _attached:
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = (shm, np.ndarray(shape, dtype, buffer=shm.buf))
+    return _attached[name][1]
+
+# Runs on a worker: STFT magnitude of frames k_a..k_b-1 of the zoom
+def segment_magnitude(signal, geometry, k_a, k_b, freq_range, sr, plan, fused, warmup, overlap, dtype):
+    stft_zoom.DTYPE = np.dtype(dtype).type # same policy as the parent
+    stft_zoom.FFT_WORKERS = 1 # the pool already has a process per CPU
+    y = attach(*signal)
+    n_start, n_end, step, n_sub, n_fft, hop = geometry
+    # decimated samples the frames need (frame k is centred on sample k*hop;
+    # outside of 0..n_sub-1 they are the zero padding of stft_zoom.stft)
+    need_lo = k_a * hop - n_fft // 2
+    need_hi = (k_b - 1) * hop - n_fft // 2 + n_fft
+    m_lo, m_hi = max(need_lo, 0), min(need_hi, n_sub)
+    z = decimated(y, m_lo, m_hi, geometry, plan, sr, fused, warmup, overlap)
+    z = np.pad(z, (m_lo - need_lo, need_hi - m_hi))
+
+    frames = np.lib.stride_tricks.sliding_window_view(z, n_fft)[::hop][: k_b - k_a]
+    return np.abs(scipy.fft.rfft(frames * stft_zoom.hann(n_fft, z.dtype), axis=-1)).T
+
+# Decimated samples m_lo..m_hi-1 of the serial path (with the modulations in
+# its phase), filtered from overlap seconds before them (from where the serial
+# path starts, for the first segment) and, fused, up to overlap seconds after
+# them
+def decimated(y, m_lo, m_hi, geometry, plan, sr, fused, warmup, overlap):
+    n_start, n_end, step, _, _, _ = geometry
+    if m_hi <= m_lo:
+        return np.zeros(0, dtype=stft_zoom.DTYPE)
+    n_a = n_start + m_lo * step
+    n_b = n_start + (m_hi - 1) * step + 1
+    origin = n_start - min(int(sr * warmup), n_start) # where the serial slice starts
+    pad = n_a - origin if m_lo == 0 else min(int(sr * overlap), n_a)
+    if not fused:
+        x = np.asarray(y[n_a - pad : n_b], dtype=stft_zoom.signal_dtype(y))
+        x = stft_zoom._filter_and_mod(x, plan, sr, n0=n_a - pad - origin)
+        return x[pad::step]
+    after = min(int(sr * overlap), n_end - n_b)
+    drop = pad % step # as stft_zoom.warmup_split, so sample 0 stays on the grid of n_start
+    x = np.asarray(y[n_a - pad + drop : n_b + after], dtype=stft_zoom.signal_dtype(y))
+    origin += (n_start - origin) % step
+    x = stft_zoom._filter_and_decimate(x, plan, step, sr, n0=n_a - pad + drop - origin)
+    return x[pad // step : pad // step + m_hi - m_lo]
@@ -0,0 +1,214 @@
+import math
+import time
+import scipy
+import instrument
+import multirate
+import stft_zoom
+
+# Cost model planner for stft_zoom. zoom_plan always takes the first valid
+# strategy in a fixed priority order; here every valid strategy for the band
+# (stft_zoom.zoom_plans) is costed for the actual slice length and resolution
+# and the cheapest one is executed.
+#
+# The cost of a plan is counted as work of a few kinds (WORK_KINDS: multiply-adds
+# of the direct FIR stages, samples x log2(taps) of the FIR stages run through
+# FFTs, points x log2(size) of the STFT, samples x sections of the IIR filters,
+# full-rate array elements written or read, and calls into numpy / scipy),
+# which is turned into an estimated time in seconds by COSTS.
+# The peak memory of the full-rate temporaries is estimated as well.
+#
+#   print(planner.explain((5000, 5500), [1, 3], 44100, 'freq. bins', 40, 'time frames', 0))
+#
+# bench_planner.py checks the estimates against measured times (see
+# set_measure_hook) and fits COSTS to the machine it runs on.
+
+WORK_KINDS = ('mac', 'conv', 'fft', 'sos', 'samples', 'calls')
+
+# seconds per unit of work of each kind (fitted with bench_planner.py)
+COSTS = {'mac': 9e-10, 'conv': 3e-9, 'fft': 1.7e-9, 'sos': 3e-9, 'samples': 2e-9, 'calls': 9e-5}
+
+measure_hook = None
+
+# hook(plan, measured) is called after every planner.zoom, with the plan that
+# was executed (its 'cost' entry has the estimates) and the measured times in
+# seconds ({'filter': ..., 'stft': ...}). Returns the previous hook.
+def set_measure_hook(hook):
+    global measure_hook
+    previous, measure_hook = measure_hook, hook
+    return previous
+
+# Every strategy of stft_zoom.zoom_plans with a 'cost' entry: the work of the
+# filtering and of the STFT, their estimated times and the estimated peak
+# memory. Plans whose output would not cover freq_range (the rate the step
+# rounds to is too low) are returned with cost None and the reason in 'invalid',
+# except for the first one, which is what stft_zoom.zoom_plan would run anyway.
+def candidates(freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res,
+               fused=True, warmup=stft_zoom.WARMUP):
+    res = (freq_res_type, freq_res, time_res_type, time_res)
+    n_slice = int(sr * time_range[1]) - int(sr * time_range[0])
+    n = n_slice + stft_zoom.warmup_samples(time_range, sr, warmup)
+
+    plans = []
+    for i, plan in enumerate(stft_zoom.zoom_plans(freq_range, sr)):
+        plan = dict(plan)
+        step = stft_zoom.fused_step(plan, sr) if fused else stft_zoom.subsample_step(plan['new_sr'], sr)
+        if i > 0 and not covers(plan, freq_range, sr / step):
+            plan.update(cost=None, invalid='%g Hz rate does not cover the band' % (sr / step))
+            plans.append(plan)
+            continue
+        filter_work, memory = (fused_work if fused else legacy_work)(plan, n, step, sr)
+        stft_work, stft_memory = analysis_work(-(-n_slice // step), freq_range, sr / step, res)
+        plan['cost'] = {'step': step,
+                        'filter_work': filter_work, 'stft_work': stft_work,
+                        'filter': estimate(filter_work), 'stft': estimate(stft_work),
+                        'memory': max(memory, stft_memory)}
+        plan['cost']['time'] = plan['cost']['filter'] + plan['cost']['stft']
+        plans.append(plan)
+    return plans
+
+# Cheapest valid plan. Plans estimated to need more than memory_limit bytes are
+# only taken if no plan fits.
+def choose(freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res,
+           fused=True, warmup=stft_zoom.WARMUP, memory_limit=None):
+    plans = [plan for plan in candidates(freq_range, time_range, sr, freq_res_type, freq_res,
+                                         time_res_type, time_res, fused, warmup) if plan['cost']]
+    if memory_limit is not None:
+        plans = [plan for plan in plans if plan['cost']['memory'] <= memory_limit] or plans
+    return min(plans, key=lambda plan: plan['cost']['time'])
+
+# Table of the candidate plans and their estimated costs, cheapest first
+def explain(freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res,
+            fused=True, warmup=stft_zoom.WARMUP):
+    plans = candidates(freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res, fused, warmup)
+    valid = sorted((plan for plan in plans if plan['cost']), key=lambda plan: plan['cost']['time'])
+    lines = ['%s Hz, %s s, %s path' % (list(freq_range), list(time_range), 'fused' if fused else 'original'),
+             '  %-16s %6s %9s %11s %9s %9s %10s' % ('strategy', 'step', 'rate (Hz)', 'filter (ms)',
+                                                    'stft (ms)', 'total (ms)', 'memory (MB)')]
+    for i, plan in enumerate(valid):
+        cost = plan['cost']
+        lines.append('%s %-16s %6d %9.1f %11.2f %9.2f %9.2f %10.1f' % (
+            '*' if i == 0 else ' ', plan['strategy'], cost['step'], sr / cost['step'],
+            1000*cost['filter'], 1000*cost['stft'], 1000*cost['time'], cost['memory'] / 2**20))
+    for plan in plans:
+        if not plan['cost']:
+            lines.append('  %-16s not valid: %s' % (plan['strategy'], plan['invalid']))
+    return '\n'.join(lines)
+
+# stft_zoom.stft_zoom (real paths) with the cheapest plan, or with plan if given
+# (one of the plans of candidates). Calls the measure hook, if set.
+# progress(fraction, stage), if given, is called before each stage with the
+# estimated fraction of the work already done (see jobs.Job.report).
+def zoom(y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res,
+         fused=True, warmup=stft_zoom.WARMUP, plan=None, progress=None):
+    res = (freq_res_type, freq_res, time_res_type, time_res)
+    if plan is None:
+        plan = choose(freq_range, time_range, sr, *res, fused=fused, warmup=warmup)
+    with instrument.stage('zoom', freq_range=list(freq_range), time_range=list(time_range), sr=sr,
+                          res=list(res), fused=fused, strategy=plan['strategy'],
+                          estimate=plan['cost'] and plan['cost']['time']) as stage:
+        if progress is not None:
+            progress(0.0, 'filtering')
+        t0 = time.perf_counter()
+        y_sub, new_sr, f_min = stft_zoom.zoom_signal(y, freq_range, time_range, sr, fused, warmup, plan)
+        t1 = time.perf_counter()
+        if progress is not None:
+            progress(filter_fraction(plan), 'stft')
+        S = stft_zoom.stft_magnitude(y_sub, freq_range, new_sr, *res)
+        D = stft_zoom.magnitude_to_db(S, out=S)
+        t2 = time.perf_counter()
+        if measure_hook is not None:
+            measure_hook(plan, {'filter': t1 - t0, 'stft': t2 - t1})
+        return stage.output(*stft_zoom.zoom_axes(D, new_sr, f_min, time_range))
+
+# Estimated fraction of the time of plan spent filtering
+def filter_fraction(plan):
+    return plan['cost']['filter'] / plan['cost']['time']
+
+def estimate(work):
+    return sum(COSTS[kind] * work[kind] for kind in WORK_KINDS)
+
+# The step of lowpass and ring mod + lpf is rounded, so the rate can end up a
+# little below new_sr (undersampling and ring mod use exact divisors of sr)
+def covers(plan, freq_range, rate):
+    if plan['strategy'] in ('lowpass', 'ring mod + lpf'):
+        return plan['f_min'] + rate / 2 >= freq_range[1]
+    return True
+
+def new_work():
+    return dict.fromkeys(WORK_KINDS, 0)
+
+# Work and peak memory (bytes) of filter_and_decimate for n input samples
+def fused_work(plan, n, step, sr):
+    work = new_work()
+    if plan['strategy'] == 'lowpass':
+        f_c = plan['lp_cutoff']
+        stages_work(work, n, multirate.stage_taps(sr, step, f_c, f_c + 100), 1)
+        return work, 8 * n
+    wp = plan['wp'] * (sr/2)
+    ws = plan['ws'] * (sr/2)
+    # complex oscillator, mixing, then complex stages and the real remix at the end
+    work['samples'] += 7 * n
+    work['calls'] += 2
+    m = stages_work(work, n, multirate.bandpass_stage_taps(sr, step, wp, ws), 2)
+    work['samples'] += 7 * m
+    return work, 32 * n
+
+# Adds the work of running n samples through FIR stages of (factor, taps), on
+# real (width 1) or complex (width 2) data. Returns the output length.
+def stages_work(work, n, stages, width):
+    for factor, taps in stages:
+        if taps > multirate.POLYPHASE_MAX_TAPS * factor:
+            work['conv'] += width * n * math.log2(2 * taps)
+        else:
+            work['mac'] += width * -(-n // factor) * taps
+        work['samples'] += width * n
+        work['calls'] += 1
+        n = -(-n // factor)
+    return n
+
+# Work and peak memory (bytes) of filter_and_mod (+ subsample_signal)
+def legacy_work(plan, n, step, sr):
+    work = new_work()
+    if plan['strategy'] == 'lowpass':
+        sos_work(work, n, stft_zoom.design_lowpass(plan['lp_cutoff'], sr))
+        return work, 8 * n
+    sos_work(work, n, stft_zoom.design_bandpass(plan['wp'], plan['ws'], sr))
+    if plan['strategy'] == 'undersampling':
+        return work, 8 * n
+    work['samples'] += 6 * n # ring mod
+    work['calls'] += 2
+    if plan['strategy'] == 'ring mod + lpf':
+        sos_work(work, n, stft_zoom.design_lowpass(plan['lp_cutoff'], sr))
+    return work, 32 * n
+
+def sos_work(work, n, sos):
+    work['sos'] += n * sos.shape[0]
+    work['samples'] += 2 * n
+    work['calls'] += 1
+
+# Work and peak memory (bytes) of the STFT (and dB conversion) of the n samples
+# of the decimated slice
+def analysis_work(n, freq_range, sr, res):
+    work = new_work()
+    window_size, hop_size = stft_zoom.stft_params(n, freq_range, sr, *res)
+    n_frames = 1 + n // max(hop_size, 1)
+    points = n_frames * window_size
+    work['fft'] += points * math.log2(max(window_size, 2)) / 2 # real input
+    work['samples'] += 4 * points
+    work['calls'] += 5
+    return work, 24 * points
+
+# Estimated time in seconds of stft_zoom.zoom_preview: czt_analyze of the slice
+# at the full rate, two complex FFTs of the chirp-z length per frame
+def preview_time(freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res):
+    n = int(sr * time_range[1]) - int(sr * time_range[0])
+    res = stft_zoom.preview_resolution(n, freq_range, sr, freq_res_type, freq_res, time_res_type, time_res)
+    window_size, hop_size = stft_zoom.stft_params(n, freq_range, sr, 'freq. bins', res[0], 'time frames', res[1])
+    n_bins = max(int((freq_range[1] - freq_range[0]) / (sr / window_size)) + 1, 2)
+    n_frames = 1 + (n + 2*(window_size // 2) - window_size) // max(hop_size, 1)
+    size = scipy.fft.next_fast_len(window_size + n_bins - 1)
+    work = new_work()
+    work['fft'] += 2 * n_frames * size * math.log2(size)
+    work['samples'] += n_frames * (4 * window_size + 4 * size)
+    work['calls'] += 8
+    return estimate(work)
@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import os
+import struct
+import sys
+import numpy as np
+import audio_store
+import jobs
+import stft_zoom
+import zoom_cache
+
+# Local zoom service. One process keeps the signals that were opened (decoded
+# once through audio_store, see there) and a zoom_cache.ZoomCache shared by
+# all its clients, so several analysts or scripts zooming into the same
+# recordings neither decode them again nor redo each other's zooms.
+#
+#   python scripts/server.py --unix /tmp/stft-zoom.sock     # or --port 8765
+#
+#   client = await server.connect('/tmp/stft-zoom.sock')   # or 'localhost:8765'
+#   D, x_axis, y_axis = await client.zoom('take1.wav', [5000, 5500], [1, 3], 44100,
+#                                         'freq. bins', 40, 'time frames', 0)
+#
+# Requests have the parameters of stft_zoom.stft_zoom, with the path of the
+# file (as seen by the server) instead of the signal; time_range None is the
+# whole file. Zooms run on a pool of worker threads (as in jobs.py, the
+# filtering and the FFTs release the GIL) and go through the cache, except
+# those with quadrature or another backend, which call stft_zoom directly.
+# Identical requests that arrive while one is being computed wait for it
+# instead of computing it again, and so do opens of the same file.
+#
+# Protocol: every message is a frame, a 4 byte big-endian length followed by
+# that many bytes. A request is one frame of JSON, {"op": "zoom", "path": ...,
+# "freq_range": ..., ...} or {"op": "info"}. A response is one frame of JSON
+# header followed, for a zoom, by one frame with the raw bytes of D, x_axis
+# and y_axis, whose dtypes and shapes are in the header; errors are a header
+# with "error". A connection handles its requests one at a time: clients that
+# want concurrency open several connections.
+
+AUDIO_STORE_SIZE = 32 # open signals kept, least recently used first out
+FRAME = struct.Struct('!I')
+ZOOM_PARAMS = ('freq_res_type', 'freq_res', 'time_res_type', 'time_res')
+ZOOM_OPTIONS = {'fused': True, 'quadrature': False, 'warmup': stft_zoom.WARMUP, 'backend': 'filter'}
+
+class ZoomServer:
+    def __init__(self, workers=jobs.POOL_SIZE, cache_budget=zoom_cache.DEFAULT_BUDGET, cache_dir=audio_store.CACHE_DIR):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        jobs.share_fft_workers(workers)
+        self.cache = zoom_cache.ZoomCache(cache_budget)
+        self.cache_dir = cache_dir
+        self.signals = collections.OrderedDict() # (path, sr) -> signal
+        self.in_flight = {} # request key -> future of its result
+        self.stats = {'requests': 0, 'coalesced': 0, 'errors': 0, 'opens': 0}
+
+    def info(self):
+        return dict(self.stats, signals=len(self.signals), in_flight=len(self.in_flight), cache=self.cache.info())
+
+    async def serve(self, path=None, host='127.0.0.1', port=None):
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    frame = await read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    request = json.loads(frame)
+                    if not isinstance(request, dict):
+                        raise ValueError('a request must be a JSON object')
+                    if request.get('op', 'zoom') == 'info':
+                        write_frame(writer, json.dumps(self.info()).encode())
+                    else:
+                        header, payload = encode_zoom(*await self.zoom(request))
+                        write_frame(writer, header)
+                        write_frame(writer, payload)
+                except Exception as error:
+                    self.stats['errors'] += 1
+                    write_frame(writer, json.dumps({'error': '%s: %s' % (type(error).__name__, error)}).encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def zoom(self, request):
+        self.stats['requests'] += 1
+        path = os.path.abspath(request['path'])
+        sr = request.get('sr', 44100)
+        time_range = request.get('time_range')
+        params = [request[name] for name in ZOOM_PARAMS]
+        options = {name: request.get(name, default) for name, default in ZOOM_OPTIONS.items()}
+        key = ('zoom', path, sr, tuple(request['freq_range']), time_range and tuple(time_range), tuple(params),
+               tuple(sorted(options.items())))
+        return await self.coalesce(key, self._zoom, path, sr, request['freq_range'], time_range, params, options)
+
+    async def _zoom(self, path, sr, freq_range, time_range, params, options):
+        y = await self.open(path, sr)
+        if time_range is None:
+            time_range = (0, len(y) / sr)
+        loop = asyncio.get_running_loop()
+        if options['quadrature'] or options['backend'] != 'filter':
+            return await loop.run_in_executor(self.executor, lambda: stft_zoom.stft_zoom(
+                y, freq_range, time_range, sr, *params, **options))
+        return await loop.run_in_executor(self.executor, lambda: self.cache.zoom(
+            y, freq_range, time_range, sr, *params, fused=options['fused'], warmup=options['warmup'],
+            file_id=(path, sr)))
+
+    # Signal of the file at rate sr, decoded (or memory-mapped from the
+    # audio_store cache) on a worker the first time
+    async def open(self, path, sr):
+        key = (path, sr)
+        if key in self.signals:
+            self.signals.move_to_end(key)
+            return self.signals[key]
+        y = await self.coalesce(('open',) + key, self._open, path, sr)
+        self.signals[key] = y
+        self.signals.move_to_end(key)
+        while len(self.signals) > AUDIO_STORE_SIZE:
+            self.signals.popitem(last=False)
+        return y
+
+    async def _open(self, path, sr):
+        self.stats['opens'] += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, audio_store.open_audio, path, sr, self.cache_dir)
+
+    # Runs fn(*args) unless a call with the same key is already running, in
+    # which case it waits for that one and shares its result (or error)
+    async def coalesce(self, key, fn, *args):
+        if key in self.in_flight:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(self.in_flight[key])
+        future = asyncio.ensure_future(fn(*args))
+        self.in_flight[key] = future
+        future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+def encode_zoom(D, x_axis, y_axis):
+    arrays = [np.ascontiguousarray(a) for a in (D, x_axis, y_axis)]
+    header = {'arrays': [{'dtype': a.dtype.str, 'shape': list(a.shape)} for a in arrays]}
+    return json.dumps(header).encode(), b''.join(a.tobytes() for a in arrays)
+
+def decode_zoom(header, payload):
+    arrays = []
+    offset = 0
+    for spec in header['arrays']:
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape']))
+        arrays.append(np.frombuffer(payload, dtype, count, offset).reshape(spec['shape']))
+        offset += count * dtype.itemsize
+    return tuple(arrays)
+
+async def read_frame(reader):
+    size, = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return await reader.readexactly(size)
+
+def write_frame(writer, data):
+    writer.write(FRAME.pack(len(data)))
+    writer.write(data)
+
+class ServerError(Exception):
+    pass
+
+class ZoomClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    # Same parameters as stft_zoom.stft_zoom, with the path of the file
+    # instead of the signal. Returns (D, x_axis, y_axis).
+    async def zoom(self, path, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res, **options):
+        request = dict(options, op='zoom', path=path, freq_range=list(freq_range), sr=sr,
+                       time_range=None if time_range is None else list(time_range))
+        request.update(zip(ZOOM_PARAMS, (freq_res_type, freq_res, time_res_type, time_res)))
+        header = await self._request(request)
+        return decode_zoom(header, await read_frame(self.reader))
+
+    async def info(self):
+        return await self._request({'op': 'info'})
+
+    async def _request(self, request):
+        write_frame(self.writer, json.dumps(request).encode())
+        await self.writer.drain()
+        header = json.loads(await read_frame(self.reader))
+        if 'error' in header:
+            raise ServerError(header['error'])
+        return header
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+# address is the path of a Unix socket or host:port
+async def connect(address):
+    if os.sep in address or ':' not in address:
+        reader, writer = await asyncio.open_unix_connection(address)
+    else:
+        host, port = address.rsplit(':', 1)
+        reader, writer = await asyncio.open_connection(host, int(port))
+    return ZoomClient(reader, writer)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serves zooms of local audio files to several clients.')
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument('--unix', metavar='PATH', help='listen on a Unix socket')
+    where.add_argument('--port', type=int, help='listen on a TCP port (of --host)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-j', '--workers', type=int, default=jobs.POOL_SIZE, help='worker threads')
+    parser.add_argument('--cache-mb', type=int, default=zoom_cache.DEFAULT_BUDGET // 2**20, help='zoom cache budget')
+    args = parser.parse_args(argv)
+    server = ZoomServer(args.workers, args.cache_mb * 2**20)
+    print('listening on %s' % (args.unix or '%s:%d' % (args.host, args.port)), file=sys.stderr)
+    try:
+        asyncio.run(server.serve(args.unix, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.unix and os.path.exists(args.unix):
+            os.remove(args.unix)
+
+if __name__ == '__main__':
+    main()
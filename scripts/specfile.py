@@ -0,0 +1,138 @@
+import json
+import struct
+import numpy as np
+
+# Compact container for spectrograms (zoom results, overviews). D is stored
+# quantized, time-major, after a small JSON header:
+#
+#   MAGIC, header length (uint32 little-endian), JSON header, zero padding up
+#   to a multiple of ALIGN bytes, then the frames: shape (frames, bins) of
+#   the stored dtype, one frame after the other
+#
+# Being time-major, any range of frames is one contiguous block of the file,
+# so Spectrogram memory-maps it and only reads (and dequantizes) the frames
+# of the window asked for. Files are written a chunk of about CHUNK values
+# (whole frames) at a time, small enough for the conversion to stay in the
+# cache, so saving never makes a full size copy of D either.
+#
+#   specfile.save('zoom.spec', D, x_axis, y_axis)            # as stft_zoom returns them
+#   spec = specfile.Spectrogram('zoom.spec')
+#   D, x_axis, y_axis = spec.window(1.0, 2.5)               # seconds
+#
+# Encodings, and the largest error they add over db_range (dB values outside
+# of it are clipped to it; by default it is [-80, 0], the range of the
+# results of stft_zoom, see magnitude_to_db):
+#
+#   uint8    (hi - lo) / 510    (0.157 dB over 80 dB), 1 byte per value
+#   uint16   (hi - lo) / 131070 (0.0006 dB over 80 dB), 2 bytes per value
+#   float16  no clipping; 2**-6 dB below 64 dB of magnitude, 2**-5 dB up to
+#            128 dB, 2 bytes per value
+#
+# The axes are not stored as arrays but as in stft_zoom.get_axes_values:
+# time_range (first and last frame times) and f_min and sr, the frequencies
+# going from f_min to f_min + sr/2. save takes the axes as stft_zoom returns
+# them and works these out from them, so they must be evenly spaced.
+
+MAGIC = b'STFTZOOM-SPEC\x00\x01\x00'
+ALIGN = 64
+CHUNK = 1 << 18
+DB_RANGE = (-80.0, 0.0)
+ENCODINGS = {'uint8': np.uint8, 'uint16': np.uint16, 'float16': np.float16}
+
+# D (bins, frames) and its axes, as returned by stft_zoom. f is a path or a
+# file open for writing in binary mode. meta: anything else to keep with it
+# (e.g. the band and resolution of the zoom), it must be JSON serializable.
+def save(f, D, x_axis, y_axis, encoding='uint8', db_range=DB_RANGE, **meta):
+    if encoding not in ENCODINGS:
+        raise ValueError('encoding must be one of %s' % ', '.join(ENCODINGS))
+    n_bins, n_frames = D.shape
+    if len(x_axis) != n_frames or len(y_axis) != n_bins:
+        raise ValueError('the axes do not match D')
+    for axis in (x_axis, y_axis):
+        if len(axis) > 2 and not np.allclose(np.diff(axis), (axis[-1] - axis[0]) / (len(axis) - 1)):
+            raise ValueError('the axes must be evenly spaced (see stft_zoom.get_axes_values)')
+
+    header = {'encoding': encoding, 'shape': [n_frames, n_bins], 'db_range': [float(v) for v in db_range],
+              'time_range': [float(x_axis[0]), float(x_axis[-1])], 'f_min': float(y_axis[0]),
+              'sr': 2 * float(y_axis[-1] - y_axis[0]), 'meta': meta}
+    if hasattr(f, 'write'):
+        write(f, header, D)
+    else:
+        with open(f, 'wb') as file:
+            write(file, header, D)
+
+def write(f, header, D):
+    data = json.dumps(header).encode()
+    start = len(MAGIC) + 4 + len(data)
+    f.write(MAGIC + struct.pack('<I', len(data)) + data + b'\0' * (-start % ALIGN))
+    chunk = max(1, CHUNK // max(D.shape[0], 1))
+    for a in range(0, D.shape[1], chunk):
+        f.write(encode(D[:, a : a + chunk].T, header['encoding'], header['db_range']).tobytes())
+
+# Frames (frames, bins) of dB in the stored encoding
+def encode(frames, encoding, db_range):
+    if encoding == 'float16':
+        return frames.astype('<f2')
+    lo, hi = db_range
+    q_max = np.iinfo(ENCODINGS[encoding]).max
+    q = np.subtract(frames, lo, dtype=np.float32)
+    q *= q_max / (hi - lo)
+    np.clip(q, 0, q_max, out=q)
+    q += 0.5 # the conversion truncates: rounds to the nearest level
+    return q.astype('<u%d' % np.dtype(ENCODINGS[encoding]).itemsize)
+
+def decode(q, encoding, db_range):
+    if encoding == 'float16':
+        return q.astype(np.float32)
+    lo, hi = db_range
+    D = q.astype(np.float32)
+    D *= (hi - lo) / np.iinfo(ENCODINGS[encoding]).max
+    D += lo
+    return D
+
+class Spectrogram:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is not a spectrogram file' % path)
+            size, = struct.unpack('<I', f.read(4))
+            self.header = json.loads(f.read(size))
+        start = len(MAGIC) + 4 + size
+        self.encoding = self.header['encoding']
+        self.db_range = self.header['db_range']
+        self.time_range = self.header['time_range']
+        self.f_min = self.header['f_min']
+        self.sr = self.header['sr']
+        self.meta = self.header['meta']
+        self.n_frames, self.n_bins = self.header['shape']
+        dtype = np.dtype(ENCODINGS[self.encoding]).newbyteorder('<')
+        if self.n_frames * self.n_bins:
+            self.data = np.memmap(path, dtype=dtype, mode='r', offset=start + (-start % ALIGN), shape=(self.n_frames, self.n_bins))
+        else:
+            self.data = np.zeros((self.n_frames, self.n_bins), dtype=dtype)
+
+    @property
+    def x_axis(self):
+        return np.linspace(self.time_range[0], self.time_range[1], self.n_frames)
+
+    @property
+    def y_axis(self):
+        return np.linspace(self.f_min, self.f_min + self.sr / 2, self.n_bins)
+
+    # Frames [start, stop) as dB (float32), shape (bins, frames)
+    def frames(self, start=0, stop=None):
+        return decode(self.data[start:stop], self.encoding, self.db_range).T
+
+    # The whole spectrogram, as (D, x_axis, y_axis)
+    def read(self):
+        return self.frames(), self.x_axis, self.y_axis
+
+    # The frames whose times are within [t_start, t_end] seconds, as (D, x_axis, y_axis)
+    def window(self, t_start, t_end):
+        x_axis = self.x_axis
+        start = np.searchsorted(x_axis, t_start, side='left')
+        stop = np.searchsorted(x_axis, t_end, side='right')
+        return self.frames(start, stop), x_axis[start:stop], self.y_axis
+
+def load(path):
+    return Spectrogram(path).read()
@@ -1,21 +1,70 @@
-import scipy.signal
+import functools
+import os
 import numpy as np
-import librosa
+import scipy # scipy.signal e scipy.fft são carregados no primeiro uso (ver gui.py)
+import instrument
+import multirate
 
+FILTER_CACHE_SIZE = 128 # projetos de filtro guardados (LRU) por tipo de filtro
+WARMUP = 0.1 # segundos de sinal antes de time_range usados só para aquecer os filtros
+
+# Tipo dos sinais e espectrogramas entre as etapas do zoom. O trecho é convertido para
+# DTYPE em slice_signal e as etapas seguintes preservam o tipo; float32 (o tipo de
+# librosa.load e de audio_store) usa metade da memória de float64. Os filtros IIR rodam
+# em float64 (os coeficientes dos projetos de ordem alta não sobrevivem a float32), em
+# blocos de FILTER_BLOCK amostras, escrevendo a saída já em DTYPE. Para o comportamento
+# antigo, stft_zoom.DTYPE = np.float64. Ver bench_dtype.py para a precisão.
+DTYPE = np.float32
+FILTER_BLOCK = 1 << 18
+
+# Núcleo da STFT (ver stft_db): as FFTs de cada bloco de quadros são divididas entre
+# FFT_WORKERS threads (o workers de scipy.fft; a variável de ambiente
+# STFT_ZOOM_FFT_WORKERS muda o padrão, que é uma por CPU; pools de zooms o dividem, ver
+# jobs.share_fft_workers, batch.py e parallel.py), e cada bloco tem no máximo
+# STFT_BLOCK amostras (quadros x n_fft), para os temporários caberem no cache. As
+# janelas são guardadas por tamanho e tipo (ver hann).
+FFT_WORKERS = int(os.environ.get('STFT_ZOOM_FFT_WORKERS', os.cpu_count() or 1))
+STFT_BLOCK = 1 << 19
+WINDOW_CACHE_SIZE = 64
+
+# Lista (ordenada) dos divisores de sr menores que sr: as taxas que podem ser obtidas
+# pegando 1 a cada N amostras. É montada a partir da fatoração de sr, só quando
+# usada pela primeira vez, e guardada para cada sr.
+@functools.lru_cache(maxsize=None)
 def compose_alpha_list(sr):
-	alpha_list = []
-	for i in range(1,sr):
-		if int(sr % i) == 0:
-			alpha_list.append(i)
-	return alpha_list
+    divisors = np.array([1])
+    primes, counts = np.unique(multirate.prime_factors(int(sr)), return_counts=True)
+    for p, k in zip(primes, counts):
+        divisors = np.outer(divisors, p ** np.arange(k + 1)).ravel()
+    divisors.sort()
+    return divisors[:-1]
 
-alpha_list = compose_alpha_list(44100)
+# pad: amostras a mais antes do início do trecho (ver warmup_samples). Se y for um
+# np.memmap (audio_store), só o trecho pedido é lido do disco.
+def slice_signal(y, time_range, sr, pad=0):
+    with instrument.stage('slice', y, pad=pad) as stage:
+        return stage.output(np.asarray(y[int(sr * time_range[0]) - pad : int(sr * time_range[1])], dtype=signal_dtype(y)))
 
-def slice_signal(y, time_range, sr):
-    return y[int(sr * time_range[0]) : int(sr * time_range[1])]
+# Tipo de um sinal sob a política DTYPE: DTYPE, ou o complexo correspondente
+def signal_dtype(y):
+    return np.result_type(DTYPE, np.complex64) if np.iscomplexobj(y) else np.dtype(DTYPE)
 
-def closest_alpha(possible_alpha):
+# Quantas amostras antes de time_range (até warmup segundos, limitado ao começo do
+# sinal) usar para aquecer os filtros
+def warmup_samples(time_range, sr, warmup):
+    return min(int(sr * warmup), int(sr * time_range[0]))
+
+# As primeiras skip amostras de y são só aquecimento. Descarta de cara o excesso que não
+# é múltiplo de step, para a fase da subamostragem continuar presa ao início do trecho
+# pedido, e retorna o sinal e quantas amostras subamostradas descartar depois.
+def warmup_split(y, skip, step):
+    return y[skip % step:], skip // step
+
+def closest_alpha(possible_alpha, sr=44100):
+    alpha_list = compose_alpha_list(sr)
     idx = np.searchsorted(alpha_list, possible_alpha, side="left")
+    if idx == len(alpha_list):
+        return alpha_list[-1]
     if alpha_list[idx] != possible_alpha:
         return alpha_list[idx-1]
     else:
@@ -32,80 +81,220 @@ def closest_alpha(possible_alpha):
 # (subamostragem ainda precisa ser feita)
     
     
-def filter_and_mod(y, freq_range, sr):
-    inverted = False # se for feito undersampling com n par, o espectro é espelhado e temos que inverter depois. essa é uma flag para essa situação
+def zoom_plan(freq_range, sr):
+    # Decide qual das opções acima será usada, sem tocar no sinal. Retorna um dict com
+    # a estratégia e os parâmetros necessários para executá-la (filter_and_mod usa os
+    # filtros IIR originais, filter_and_decimate usa o motor multirate).
+    return zoom_plans(freq_range, sr)[0]
 
+# Todas as estratégias possíveis para freq_range, na ordem de prioridade acima.
+# planner.py escolhe entre elas pelo custo estimado. O passa-baixas não é oferecido
+# para bandas acima de 200 Hz: o resultado iria de 0 Hz a freq_range[1], não só a banda.
+def zoom_plans(freq_range, sr):
+    plans = []
     if freq_range[0] <= 200:
-        return filter_lowpass(y, freq_range[1], sr), 2*(freq_range[1]+100), 0, inverted
-      
-    wp = np.array([freq_range[0] - 50, freq_range[1] + 50])
+        plans.append({'strategy': 'lowpass', 'new_sr': 2*(freq_range[1]+100), 'f_min': 0, 'inverted': False,
+                      'lp_cutoff': freq_range[1]})
+
+    wp = np.array([freq_range[0] - 50, freq_range[1] + 50], dtype=float)
     ws = np.array([wp[0] - 50, wp[1] + 150]) # [alpha, beta]
 
-    possible_alpha = closest_alpha(ws[0])
-    new_sr = find_undersample_fs(ws)
-    # new_sr = check_subsample(sr, [possible_alpha, ws[1]])
+    if ws[0] > 0:
+        possible_alpha = closest_alpha(ws[0], sr)
+        new_sr = find_undersample_fs(ws, sr)
+        base = {'wp': wp / (sr/2), 'ws': ws / (sr/2), 'inverted': False}
 
-    wp = wp / (sr/2)
-    ws = ws / (sr/2)
-    
-    y_filt = filter_bandpass(y, wp, ws, sr)
-    
-    if not new_sr:  # ver se aliasing inteligente é possível
-        new_sr = check_subsample(sr, [possible_alpha, ws[1]])
-        if not new_sr: # ringmod + lpf
-            new_sr = (ws[1] - ws[0] + 100/(sr/2)) * sr
-            print("ring mod + lpf")
-            return filter_lowpass(ring_mod(y_filt, ws[0]*(sr/2), sr), new_sr/2 - 100, sr), new_sr, ws[0]*(sr/2), inverted         
-        print("ring mod")
-        return ring_mod(y_filt, possible_alpha, sr), new_sr, possible_alpha, inverted
-    
-    print("undersampling")
-    new_freq_range = treat_undersampling(new_sr[0], new_sr[1], ws*(sr/2))
-    if new_sr[1] == 0: # undersampling frequency found using even n, mirroring of spectrum is needed
-        print(new_sr, new_freq_range)
-        inverted = True
-        return y_filt, new_sr[0], [ws*(sr/2), new_freq_range], inverted
-
-    print(new_sr, new_freq_range)
-    return y_filt, new_sr[0], ws[0]*(sr/2) - new_freq_range[0], inverted
-
-    # if not new_sr:  # fazer ringmod e filtrar com pb
-    #     new_sr = (ws[1] - ws[0] + 100/(sr/2)) * sr
-    #     return filter_lowpass(ring_mod(y_filt, ws[0]*(sr/2), sr), new_sr/2 - 100, sr), new_sr, ws[0]*(sr/2), False
-    
-    # return ring_mod(y_filt, possible_alpha, sr), new_sr, possible_alpha, False
-    
-def filter_bandpass(y, wp, ws, sr):
-    N, wn = scipy.signal.buttord(wp, ws, 3, 30)
+        if new_sr:
+            plan = dict(base, strategy='undersampling', new_sr=new_sr[0], parity=new_sr[1],
+                        new_freq_range=treat_undersampling(new_sr[0], new_sr[1], ws))
+            if new_sr[1] == 0: # undersampling frequency found using even n, mirroring of spectrum is needed
+                plan.update(inverted=True, f_min=[ws, plan['new_freq_range']])
+            else:
+                plan['f_min'] = ws[0] - plan['new_freq_range'][0]
+            plans.append(plan)
+
+        new_sr = check_subsample(sr, [possible_alpha, ws[1]]) # ver se aliasing inteligente é possível
+        if new_sr:
+            plans.append(dict(base, strategy='ring mod', new_sr=new_sr, f_min=possible_alpha, mod_freq=possible_alpha))
+
+        new_sr = 2 * (ws[1] - ws[0] + 100) # ringmod + lpf
+        plans.append(dict(base, strategy='ring mod + lpf', new_sr=new_sr, f_min=ws[0],
+                          mod_freq=ws[0], lp_cutoff=new_sr/2 - 100))
+
+    return plans
+
+# skip: amostras do começo de y que só servem para aquecer os filtros e são descartadas
+# plan: uma das estratégias de zoom_plans (por padrão, a de zoom_plan)
+# A estratégia escolhida fica registrada no estágio 'filter_and_mod' (ver instrument.py).
+def filter_and_mod(y, freq_range, sr, skip=0, plan=None):
+    if plan is None:
+        plan = zoom_plan(freq_range, sr)
+    with instrument.stage('filter_and_mod', y, **plan_info(plan)) as stage:
+        y_mod = stage.output(_filter_and_mod(y, plan, sr)[skip:])
+    return y_mod, plan['new_sr'], plan['f_min'], plan['inverted']
+
+# n0: posição de y[0] no sinal de referência das modulações (o oscilador tem fase 0 na
+# amostra 0); trechos de um mesmo sinal filtrados separadamente (ver parallel.py)
+# continuam com a mesma fase
+def _filter_and_mod(y, plan, sr, n0=0):
+    strategy = plan['strategy']
+    if strategy == 'lowpass':
+        return filter_lowpass(y, plan['lp_cutoff'], sr)
+
+    y_filt = filter_bandpass(y, plan['wp'], plan['ws'], sr)
+
+    # y_filt é só nosso: a modulação e o passa-baixas podem escrever nele mesmo
+    if strategy == 'ring mod + lpf':
+        y_mod = ring_mod(y_filt, plan['mod_freq'], sr, out=y_filt, n0=n0)
+        return filter_lowpass(y_mod, plan['lp_cutoff'], sr, out=y_mod)
+    if strategy == 'ring mod':
+        return ring_mod(y_filt, plan['mod_freq'], sr, out=y_filt, n0=n0)
+    return y_filt
+
+# O que antes era impresso sobre a estratégia escolhida
+def plan_info(plan):
+    info = {'strategy': plan['strategy'], 'new_sr': plan['new_sr']}
+    if plan['strategy'] == 'undersampling':
+        info.update(parity=plan['parity'], new_freq_range=plan['new_freq_range'])
+    return info
+
+# Mesmas estratégias de filter_and_mod, mas filtrando e subamostrando num passo só
+# (ver multirate.py): só as amostras que sobrevivem à subamostragem são calculadas.
+# Retorna o sinal já subamostrado, a nova taxa de amostragem, f_min e inverted, ou seja,
+# substitui filter_and_mod + subsample_signal.
+def filter_and_decimate(y, freq_range, sr, skip=0, plan=None):
+    if plan is None:
+        plan = zoom_plan(freq_range, sr)
+    step = fused_step(plan, sr)
+    with instrument.stage('filter_and_decimate', y, step=step, **plan_info(plan)) as stage:
+        y, skip = warmup_split(y, skip, step)
+        y_sub = stage.output(_filter_and_decimate(y, plan, step, sr)[skip:])
+    return y_sub, sr/step, plan['f_min'], plan['inverted']
+
+# n0: como em _filter_and_mod
+def _filter_and_decimate(y, plan, step, sr, n0=0):
+    strategy = plan['strategy']
+    if strategy == 'lowpass':
+        f_c = plan['lp_cutoff']
+        return multirate.lowpass_decimate(y, step, f_c, f_c + 100, sr)
+
+    wp = plan['wp'] * (sr/2)
+    ws = plan['ws'] * (sr/2)
+
+    if strategy == 'ring mod + lpf':
+        # o lpf depois da modulação só deixa passar metade do produto do ring mod
+        y_sub = multirate.bandpass_decimate(y, step, wp, ws, sr, shift=plan['mod_freq'], n0=n0)
+        y_sub *= 0.5
+        return y_sub
+    if strategy == 'ring mod':
+        return multirate.bandpass_decimate(y, step, wp, ws, sr, shift=plan['mod_freq'], n0=n0)
+    return multirate.bandpass_decimate(y, step, wp, ws, sr, n0=n0)
+
+# Fator de subamostragem usado por filter_and_decimate. Onde a nova taxa só precisa
+# ser *pelo menos* new_sr, arredonda para um fator que pode ser dividido em estágios.
+def fused_step(plan, sr):
+    step = subsample_step(plan['new_sr'], sr)
+    if plan['strategy'] in ('lowpass', 'ring mod + lpf'):
+        return multirate.smooth_step(step)
+    return step
+
+# out: onde escrever o resultado (pode ser o próprio y)
+def filter_bandpass(y, wp, ws, sr, out=None):
+    sos = design_bandpass(wp, ws, sr)
+    with instrument.stage('filtering', y, filter='bandpass', sections=len(sos)) as stage:
+        return stage.output(sosfilt(sos, y, out))
+
+def filter_lowpass(y, f_c, sr, out=None):
+    sos = design_lowpass(f_c, sr)
+    with instrument.stage('filtering', y, filter='lowpass', sections=len(sos)) as stage:
+        return stage.output(sosfilt(sos, y, out))
+
+# scipy.signal.sosfilt em blocos: a conta é em float64, mas só um bloco de cada vez
+# existe em float64; a saída (out, ou um array novo) fica no tipo de signal_dtype(y)
+def sosfilt(sos, y, out=None):
+    if out is None:
+        out = np.empty(len(y), dtype=signal_dtype(y))
+    zi = np.zeros((len(sos), 2))
+    for i in range(0, len(y), FILTER_BLOCK):
+        out[i : i + FILTER_BLOCK], zi = scipy.signal.sosfilt(sos, y[i : i + FILTER_BLOCK], zi=zi)
+    return out
+
+# Os projetos de filtro são guardados num cache LRU, com chave nas bordas normalizadas,
+# na taxa de amostragem e na especificação do filtro: zooms repetidos (ou deslocando só
+# no tempo) não precisam projetar os filtros de novo. Os coeficientes retornados são
+# compartilhados entre chamadas e não devem ser modificados.
+def design_bandpass(wp, ws, sr, gpass=3, gstop=30):
+    with instrument.stage('filter design', filter='bandpass') as stage:
+        return stage.output(_design_bandpass(tuple(map(float, wp)), tuple(map(float, ws)), sr, gpass, gstop))
+
+def design_lowpass(f_c, sr, order=7, rp=3, rs=80):
+    with instrument.stage('filter design', filter='lowpass') as stage:
+        return stage.output(_design_lowpass(float(f_c / (sr/2)), sr, order, rp, rs))
+
+@functools.lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _design_bandpass(wp, ws, sr, gpass, gstop):
+    N, wn = scipy.signal.buttord(wp, ws, gpass, gstop)
     sos = scipy.signal.butter(N, wn, 'band', output='sos')
-    return scipy.signal.sosfilt(sos, y)
+    return sos
+
+@functools.lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _design_lowpass(wn, sr, order, rp, rs):
+    sos = scipy.signal.ellip(order, rp, rs, wn, output='sos')
+    return sos
+
+# Contadores de acertos/faltas de cada cache de projeto de filtro
+def filter_cache_info():
+    return {'bandpass': _design_bandpass.cache_info(),
+            'lowpass': _design_lowpass.cache_info(),
+            'multirate': multirate._design_lowpass_stages.cache_info()}
+
+def clear_filter_cache():
+    _design_bandpass.cache_clear()
+    _design_lowpass.cache_clear()
+    multirate._design_lowpass_stages.cache_clear()
+
+# Pré-aquece o cache com os filtros (dos dois caminhos, filter_and_mod e
+# filter_and_decimate) de um conjunto de bandas de interesse
+def prewarm_filter_cache(bands, sr=44100):
+    for freq_range in bands:
+        plan = zoom_plan(freq_range, sr)
+        step = fused_step(plan, sr)
+        if plan['strategy'] == 'lowpass':
+            f_c = plan['lp_cutoff']
+            design_lowpass(f_c, sr)
+            multirate.design_lowpass_stages(sr, step, f_c, f_c + 100)
+            continue
+        design_bandpass(plan['wp'], plan['ws'], sr)
+        multirate.design_bandpass_stages(sr, step, plan['wp'] * (sr/2), plan['ws'] * (sr/2))
+        if plan['strategy'] == 'ring mod + lpf':
+            design_lowpass(plan['lp_cutoff'], sr)
 
-def filter_lowpass(y, f_c, sr):
-    anti_alias = scipy.signal.ellip(7, 3, 80, f_c / (sr/2), output='sos')
-    return scipy.signal.sosfilt(anti_alias, y)
-    
 # retorna 0 se não é possível fazer undersampling
 # retorna a nova taxa de amostragem caso contrário
-def find_undersample_fs(freq_range):
+# (todos os n candidatos são testados de uma vez; vale o maior n possível)
+def find_undersample_fs(freq_range, sr=44100):
+    alpha_list = compose_alpha_list(sr)
     f_l = freq_range[0]
     f_h = freq_range[1]
 
     n_upperlim = int(np.floor(f_h/(f_h - f_l)))
-    
-    for n in range(n_upperlim, 1, -1):
-        new_sr_h = 2 * f_l / (n-1)
-        new_sr_l = 2 * f_h / n
+    n = np.arange(n_upperlim, 1, -1)
+    if len(n) == 0:
+        return(0)
 
-        i_l = np.searchsorted(alpha_list, new_sr_l)
-        i_h = np.searchsorted(alpha_list, new_sr_h)
+    new_sr_h = 2 * f_l / (n-1)
+    new_sr_l = 2 * f_h / n
 
-        if i_l != i_h:
-            return alpha_list[i_h-1], n % 2
+    i_l = np.searchsorted(alpha_list, new_sr_l)
+    i_h = np.searchsorted(alpha_list, new_sr_h)
 
-    return(0)
+    found = np.flatnonzero(i_l != i_h)
+    if len(found) == 0:
+        return(0)
+    k = found[0]
+    return alpha_list[i_h[k]-1], n[k] % 2
 
 def treat_undersampling(undersample_freq, n_parity, freq_range):
-    print(freq_range)
     if n_parity == 0:
         new_fl = np.ceil(freq_range[1]/undersample_freq) * undersample_freq - freq_range[1]
         new_fh = new_fl + freq_range[1] - freq_range[0]
@@ -120,58 +309,275 @@ def check_subsample(sr, ws):
     M_upperlim = int(ws[0] // (ws[1] - ws[0]))
     if M_upperlim < 1:
         return False
-    for M in range(M_upperlim, 0, -1):
-        if test_new_sr(2 * ws[0] / M, sr):
-            return (2 * ws[0] / M)
-    return False  # não é possível fazer o "aliasing inteligente"
+    new_sr = 2 * ws[0] / np.arange(M_upperlim, 0, -1)
+    ok = np.flatnonzero(test_new_sr(new_sr, sr))
+    if len(ok) == 0:
+        return False  # não é possível fazer o "aliasing inteligente"
+    return new_sr[ok[0]]
                              
         
 # Testa se a nova taxa de amostragem pode ser obtida 
 # com uma subamostragem simples (selecionado 1 a cada X amostras de y)
+# (aceita um array de taxas candidatas)
 def test_new_sr(new_sr, sr):
-    if int(sr % new_sr) == 0:
-        return True
-    else:
-        return False
+    return np.mod(sr, new_sr) < 1
+
+# out: onde escrever o resultado (pode ser o próprio y)
+# n0: posição de y[0] no sinal (o oscilador tem fase 0 na amostra 0)
+def ring_mod(y, freq, sr, out=None, n0=0):
+    with instrument.stage('modulation', y, freq=freq) as stage:
+        carrier = multirate.oscillator(len(y), freq, sr, phase=multirate.phase_at(n0, freq, sr),
+                                       dtype=np.result_type(y.dtype, np.complex64)).real
+        return stage.output(np.multiply(y, carrier, out=out))
+
+# Alternativa ao ring mod: desce a banda para banda base com um oscilador complexo
+# (I/Q), centrando freq_range em 0 Hz, e filtra com passa-baixas e subamostra o sinal
+# complexo. Como não há banda imagem, a taxa necessária é a metade da do
+# "ring mod + lpf" e não há espectro espelhado para desfazer.
+# Retorna o sinal complexo já subamostrado, a nova taxa e a frequência central.
+def quadrature_downconvert(y, freq_range, sr, skip=0):
+    wp = np.array([freq_range[0] - 50, freq_range[1] + 50])
+    ws = np.array([wp[0] - 50, wp[1] + 50])
+    new_sr = ws[1] - ws[0] # largura total do espectro (dos dois lados) a representar
+    step = multirate.smooth_step(subsample_step(new_sr, sr))
+    y, skip = warmup_split(y, skip, step)
+    z, f_c = multirate.bandpass_baseband(y, step, wp, ws, sr)
+    return z[skip:], sr/step, f_c
 
-def ring_mod(y, freq, sr):
-    t_final = len(y) / sr
-    t = np.linspace(0,t_final, int(sr*t_final))
-    x = np.cos(2*np.pi*freq*t)
-    return x*y
+def subsample_step(new_sr, sr):
+    return int(np.ceil(sr/new_sr)) # pegar 1 em cada subsample_step amostras de y
 
 def subsample_signal(y, new_sr, sr):
-    subsample_step = int(np.ceil(sr/new_sr)) # pegar 1 em cada subsample_step amostras de y
-    return y[::subsample_step], sr/subsample_step  # sinal subamostrado, new_sr
+    step = subsample_step(new_sr, sr)
+    with instrument.stage('subsampling', y, step=step) as stage:
+        return stage.output(y[::step]), sr/step  # sinal subamostrado, new_sr
 
 def analyze_slice(y, freq_range, sr, freq_res_type, freq_res, time_res_type, time_res):
     # devolve matriz da FFT de y no intervalo freq_range, time_range de acordo com alguma
     # "heuristica de resolução", por ex: quero 10 bins de freq nesse intervalo, 10 frames de tempo
+    if not np.iscomplexobj(y):
+        return stft_db(y, *stft_params(len(y), freq_range, sr, freq_res_type, freq_res, time_res_type, time_res))
+    S = stft_magnitude(y, freq_range, sr, freq_res_type, freq_res, time_res_type, time_res)
+    return magnitude_to_db(S, out=S)
+
+# dB em relação ao máximo de S, limitado a -top_db (o mesmo que
+# librosa.amplitude_to_db(S, ref=np.max)). out: onde escrever o resultado (pode ser o
+# próprio S, se ele não for usado depois)
+def magnitude_to_db(S, out=None, amin=1e-5, top_db=80.0):
+    with instrument.stage('db', S) as stage:
+        ref = max(S.max(), amin)
+        D = np.maximum(S, amin, out=out)
+        np.log10(D, out=D)
+        D *= 20
+        D -= 20 * np.log10(ref)
+        return stage.output(np.maximum(D, -top_db, out=D))
+
+# Magnitude da STFT usada por analyze_slice, antes da conversão para dB
+def stft_magnitude(y, freq_range, sr, freq_res_type, freq_res, time_res_type, time_res):
+    window_size, hop_size = stft_params(len(y), freq_range, sr, freq_res_type, freq_res, time_res_type, time_res)
+
+    with instrument.stage('stft', y, n_fft=window_size, hop=hop_size) as stage:
+        if np.iscomplexobj(y): # sinal I/Q: espectro dos dois lados, de -sr/2 a sr/2
+            S = stft_twosided(y, window_size, hop_size)
+        else:
+            S = stft(y, window_size, hop_size)
+        return stage.output(np.abs(S))
+
+# STFT com as convenções de librosa.stft (quadros centrados, com zeros nas bordas, e
+# janela de Hann), só com numpy e scipy.fft. Retorna (bins, quadros); se y tiver várias
+# linhas, (linhas, bins, quadros).
+def stft(y, n_fft, hop_length):
+    y_pad = np.pad(y, [(0, 0)] * (np.ndim(y) - 1) + [(n_fft // 2, n_fft // 2)])
+    frames = np.lib.stride_tricks.sliding_window_view(y_pad, n_fft, axis=-1)[..., ::hop_length, :]
+    return np.swapaxes(scipy.fft.rfft(frames * hann(n_fft, y_pad.dtype), axis=-1, workers=FFT_WORKERS), -1, -2)
+
+# Magnitude da STFT de y (real, com as convenções de stft) já em dB, escrita direto em
+# out (bins, quadros), sem passar pela matriz complexa nem pela de magnitudes inteiras:
+# cada bloco de quadros vira potência e dB dentro de out, e no fim out é deslocado
+# para a referência. ref=None é o máximo do resultado (o mesmo que magnitude_to_db);
+# senão, a magnitude que vale 0 dB. top_db=None não limita o mínimo. start e stop
+# escolhem um intervalo dos quadros; out pode ser a transposta de um array (quadros,
+# bins), como os níveis de tiles.py. Os quadros são vistas de y (só os das bordas, que
+# pegam os zeros do preenchimento, são copiados), então y pode ser um np.memmap longo.
+def stft_db(y, n_fft, hop_length, start=0, stop=None, out=None, ref=None, amin=1e-5, top_db=80.0):
+    half = n_fft // 2
+    if stop is None:
+        stop = 1 + (len(y) + 2*half - n_fft) // hop_length
+    if out is None:
+        out = np.empty((half + 1, stop - start), dtype=signal_dtype(y))
+    block = max(1, STFT_BLOCK // n_fft)
+    with instrument.stage('stft', y, n_fft=n_fft, hop=hop_length, db=True) as stage:
+        for a in range(start, stop, block):
+            b = min(a + block, stop)
+            first, last = a * hop_length - half, (b - 1) * hop_length - half + n_fft
+            if first >= 0 and last <= len(y):
+                segment = np.asarray(y[first:last], dtype=out.dtype)
+            else:
+                segment = np.zeros(last - first, dtype=out.dtype)
+                lo, hi = max(first, 0), min(last, len(y))
+                segment[lo - first : hi - first] = y[lo:hi]
+            frames = np.lib.stride_tricks.sliding_window_view(segment, n_fft)[::hop_length]
+            X = scipy.fft.rfft(frames * hann(n_fft, out.dtype), axis=-1, workers=FFT_WORKERS)
+            X = X.view(out.dtype) # (quadros, 2*bins): real, imaginário, real...
+            X *= X
+            P = out[:, a - start : b - start].T # (quadros, bins)
+            np.add(X[:, 0::2], X[:, 1::2], out=P) # potência
+            np.maximum(P, amin**2, out=P)
+            np.log10(P, out=P)
+            P *= 10
+        ref_db = out.max() if ref is None else 20 * np.log10(max(ref, amin))
+        out -= ref_db
+        if top_db is not None:
+            np.maximum(out, -top_db, out=out)
+        return stage.output(out)
+
+# Janela de Hann periódica, a mesma de scipy.signal.get_window('hann', n). As janelas
+# são guardadas (LRU) por tamanho e tipo e compartilhadas entre chamadas, por isso são
+# só de leitura.
+def hann(n, dtype=np.float64):
+    return _hann(int(n), np.dtype(dtype))
+
+@functools.lru_cache(maxsize=WINDOW_CACHE_SIZE)
+def _hann(n, dtype):
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n) / n)).astype(dtype)
+    window.setflags(write=False)
+    return window
+
+# Tamanho da janela e do hop da STFT de um sinal com n amostras (ver analyze_slice)
+def stft_params(n, freq_range, sr, freq_res_type, freq_res, time_res_type, time_res):
     if freq_res_type == 'freq. bins':
         freq_res_hz = (freq_range[1] - freq_range[0]) / freq_res
         window_size = int(sr // freq_res_hz)
     else: # freq res specified in Hz per bin
         window_size = int(sr // freq_res)
 
-    if window_size > len(y):
-        window_size = len(y) 
-        
+    if window_size > n:
+        window_size = n
+
     if time_res == 0:
         hop_size = window_size // 4
     elif time_res_type == 'time frames':
-        hop_size = int(len(y) / time_res)
+        hop_size = int(n / time_res)
     else:
         hop_size = int(sr*time_res/1000)
+    return window_size, hop_size
+
+# STFT de um sinal complexo com as mesmas convenções de librosa.stft (janela de hann,
+# quadros centrados com zeros nas bordas), mas com as frequências negativas também.
+# As linhas vão da frequência mais negativa à mais positiva (ver twosided_frequencies).
+def stft_twosided(y, n_fft, hop_length):
+    window = hann(n_fft, y.real.dtype)
+    y_pad = np.pad(y, n_fft // 2)
+    frames = np.lib.stride_tricks.sliding_window_view(y_pad, n_fft)[::hop_length]
+    return np.fft.fftshift(scipy.fft.fft(frames * window, axis=1), axes=1).T
 
-    return librosa.amplitude_to_db(np.abs(librosa.stft(y, n_fft=window_size, hop_length=hop_size)), ref=np.max)
+def twosided_frequencies(sr, n_fft, f_c=0):
+    return f_c + np.fft.fftshift(np.fft.fftfreq(n_fft, 1/sr))
 
-def stft_zoom(y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res):
-    inverted = False
-    y_mod, new_sr, f_min, inverted = filter_and_mod(slice_signal(y, time_range, sr), freq_range, sr)
-    y_sub, new_sr = subsample_signal(y_mod, new_sr, sr)
+# fused=False usa o caminho original (IIR na taxa cheia e depois y[::step])
+# quadrature=True usa quadrature_downconvert (fora da banda do passa-baixas) e devolve o
+# espectro dos dois lados da frequência central
+# warmup: segundos de sinal antes de time_range usados para aquecer os filtros
+# backend='czt' troca filtragem + analyze_slice por czt_analyze (ver abaixo)
+# plan: estratégia a usar (ver zoom_plans e planner.py); por padrão, a de zoom_plan
+# Com instrument.py ligado, todos os estágios ficam dentro de um estágio 'zoom'.
+def stft_zoom(y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res, fused=True, quadrature=False, warmup=WARMUP, backend='filter', plan=None):
+    with instrument.stage('zoom', freq_range=list(freq_range), time_range=list(time_range), sr=sr,
+                          res=[freq_res_type, freq_res, time_res_type, time_res], fused=fused,
+                          quadrature=quadrature, backend=backend) as stage:
+        return stage.output(*_stft_zoom(y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res, fused, quadrature, warmup, backend, plan))
 
+def _stft_zoom(y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res, fused, quadrature, warmup, backend, plan):
+    if backend == 'czt':
+        return czt_analyze(slice_signal(y, time_range, sr), freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res)
+    if quadrature and freq_range[0] > 200:
+        pad = warmup_samples(time_range, sr, warmup)
+        z, new_sr, f_c = quadrature_downconvert(slice_signal(y, time_range, sr, pad), freq_range, sr, skip=pad)
+        D = analyze_slice(z, freq_range, new_sr, freq_res_type, freq_res, time_res_type, time_res)
+        x_axis, _ = get_axes_values(new_sr, f_c, time_range, D.shape)
+        return D, x_axis, twosided_frequencies(new_sr, D.shape[0], f_c)
+
+    y_sub, new_sr, f_min = zoom_signal(y, freq_range, time_range, sr, fused, warmup, plan)
     D = analyze_slice(y_sub, freq_range, new_sr, freq_res_type, freq_res, time_res_type, time_res)
-    
+    return zoom_axes(D, new_sr, f_min, time_range)
+
+# Trecho time_range de y filtrado, modulado e subamostrado, pronto para a STFT (a parte
+# de stft_zoom que não depende da resolução). Retorna o sinal, a nova taxa e f_min.
+def zoom_signal(y, freq_range, time_range, sr, fused=True, warmup=WARMUP, plan=None):
+    pad = warmup_samples(time_range, sr, warmup)
+    y_slice = slice_signal(y, time_range, sr, pad)
+    if fused:
+        y_sub, new_sr, f_min, _ = filter_and_decimate(y_slice, freq_range, sr, skip=pad, plan=plan)
+    else:
+        y_mod, new_sr, f_min, _ = filter_and_mod(y_slice, freq_range, sr, skip=pad, plan=plan)
+        y_sub, new_sr = subsample_signal(y_mod, new_sr, sr)
+    return y_sub, new_sr, f_min
+
+# Backend "zoom FFT": em vez de filtrar e subamostrar, calcula em cada quadro (na taxa
+# original) só os bins de freq_range, com a transformada chirp-Z. A janela tem a mesma
+# duração (e portanto a mesma resolução em frequência) e o hop a mesma duração que em
+# analyze_slice. Compensa para bandas muito estreitas em trechos curtos, onde o custo
+# de filtrar o trecho todo domina. Retorna (D, x_axis, y_axis) como stft_zoom, com as
+# linhas de D indo de freq_range[0] a freq_range[1].
+def czt_analyze(y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res):
+    window_size, hop_size = stft_params(len(y), freq_range, sr, freq_res_type, freq_res, time_res_type, time_res)
+    bin_hz = sr / window_size
+    n_bins = max(int((freq_range[1] - freq_range[0]) / bin_hz) + 1, 2) # as bordas, pelo menos
+
+    frames = centered_frames(y, window_size, hop_size)
+    window = hann(window_size)
+    with instrument.stage('stft', y, n_fft=window_size, hop=hop_size, backend='czt') as stage:
+        zoom_fft = scipy.signal.ZoomFFT(window_size, freq_range, n_bins, fs=sr, endpoint=True)
+        S = stage.output(np.abs(zoom_fft(frames * window, axis=-1)).T.astype(DTYPE))
+
+    D = magnitude_to_db(S, out=S)
+    x_axis, _ = get_axes_values(sr, 0, time_range, D.shape)
+    return D, x_axis, np.linspace(freq_range[0], freq_range[1], n_bins)
+
+PREVIEW_BINS = 64 # resolução máxima da prévia de stft_zoom_progressive
+PREVIEW_FRAMES = 128
+PREVIEW_WINDOW = 4096 # amostras (na taxa sr), no máximo, na janela da prévia
+
+# Prévia barata de stft_zoom: czt_analyze com no máximo PREVIEW_BINS bins em freq_range,
+# PREVIEW_FRAMES quadros e PREVIEW_WINDOW amostras de janela (janela mais curta e hop
+# maior que os pedidos, se preciso). O custo fica limitado por PREVIEW_FRAMES x
+# PREVIEW_WINDOW, qualquer que seja o trecho ou a banda; em bandas estreitas a
+# resolução em frequência da prévia é bem menor que a pedida (ver
+# planner.preview_time, que estima o custo). O trecho não é copiado (centered_frames
+# só lê as amostras dos quadros).
+def zoom_preview(y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res):
+    y_slice = y[int(sr * time_range[0]) : int(sr * time_range[1])]
+    bins, frames = preview_resolution(len(y_slice), freq_range, sr, freq_res_type, freq_res, time_res_type, time_res)
+    return czt_analyze(y_slice, freq_range, time_range, sr, 'freq. bins', bins, 'time frames', frames)
+
+# Resolução ('freq. bins', 'time frames') da prévia de um trecho de n amostras
+def preview_resolution(n, freq_range, sr, freq_res_type, freq_res, time_res_type, time_res):
+    window_size, hop_size = stft_params(n, freq_range, sr, freq_res_type, freq_res, time_res_type, time_res)
+    window_size = min(window_size, PREVIEW_WINDOW)
+    bins = min((freq_range[1] - freq_range[0]) / (sr / max(window_size, 1)), PREVIEW_BINS)
+    frames = min(n / max(hop_size, 1), PREVIEW_FRAMES)
+    return bins, frames
+
+# stft_zoom em etapas: um gerador que primeiro devolve a prévia de zoom_preview (com
+# custo limitado) e depois o resultado completo de stft_zoom, ambos como (D, x_axis, y_axis).
+def stft_zoom_progressive(y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res, fused=True, warmup=WARMUP, plan=None):
+    yield zoom_preview(y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res)
+    yield stft_zoom(y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res, fused=fused, warmup=warmup, plan=plan)
+
+# Quadros centrados (com zeros nas bordas, como librosa.stft) de y, um por linha. Se os
+# quadros não se sobrepõem, copia só as amostras usadas, sem passar pelo trecho todo.
+def centered_frames(y, window_size, hop_size):
+    if hop_size < window_size:
+        y_pad = np.pad(np.asarray(y, dtype=float), window_size // 2)
+        return np.lib.stride_tricks.sliding_window_view(y_pad, window_size)[::hop_size]
+    n_frames = -(-(len(y) + 2*(window_size // 2) - window_size + 1) // hop_size)
+    idx = (np.arange(n_frames) * hop_size - window_size // 2)[:, None] + np.arange(window_size)
+    inside = (idx >= 0) & (idx < len(y))
+    return np.where(inside, np.asarray(y)[np.clip(idx, 0, len(y) - 1)], 0.0)
+
+# Eixos do espectrograma D (e desespelhamento, se preciso) a partir do f_min de
+# filter_and_mod / filter_and_decimate
+def zoom_axes(D, new_sr, f_min, time_range):
     if type(f_min) is list: # undersampling que inverteu o espectro entre f_min[0] e f_min[1]
         ws = f_min[0]
         new_freq_range = f_min[1]        
@@ -183,11 +589,174 @@ def stft_zoom(y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_t
 
     return D, x_axis, y_axis
 
+# Várias regiões de uma vez. regions é uma lista de tuplas com os mesmos parâmetros de
+# stft_zoom: (freq_range, time_range, freq_res_type, freq_res, time_res_type, time_res).
+# As regiões são agrupadas por banda e, dentro de cada banda, os trechos de tempo que se
+# sobrepõem são filtrados e subamostrados uma vez só (filter_and_decimate); cada região
+# é então recortada do sinal já subamostrado. As STFTs de regiões com o mesmo tamanho,
+# janela e hop são feitas juntas. Retorna a lista de (D, x_axis, y_axis) na mesma ordem
+# de regions.
+def stft_zoom_batch(y, regions, sr, warmup=WARMUP):
+    results = [None] * len(regions)
+    by_band = {}
+    for i, region in enumerate(regions):
+        by_band.setdefault(tuple(region[0]), []).append(i)
+
+    for freq_range, indices in by_band.items():
+        indices = sorted(indices, key=lambda i: regions[i][1][0])
+        for span, span_indices in merge_time_spans(regions, indices):
+            pad = warmup_samples(span, sr, warmup)
+            y_sub, new_sr, f_min, _ = filter_and_decimate(slice_signal(y, span, sr, pad), freq_range, sr, skip=pad)
+            step = int(round(sr / new_sr))
+            span_start = int(sr * span[0])
+
+            stft_groups = {}
+            for i in span_indices:
+                time_range = regions[i][1]
+                start = int(round((int(sr * time_range[0]) - span_start) / step))
+                n_region = max(min(int(sr * time_range[1]), len(y)) - int(sr * time_range[0]), 0) # len(slice_signal(...))
+                n_sub = -(-n_region // step)
+                y_region = y_sub[start : start + n_sub]
+                params = stft_params(len(y_region), freq_range, new_sr, *regions[i][2:])
+                stft_groups.setdefault((len(y_region),) + params, []).append((i, y_region))
+
+            for (_, window_size, hop_size), group in stft_groups.items():
+                S = np.abs(stft(np.stack([y_region for _, y_region in group]), window_size, hop_size))
+                for (i, _), S_region in zip(group, S):
+                    D = magnitude_to_db(S_region, out=S_region)
+                    results[i] = zoom_axes(D, new_sr, f_min, regions[i][1])
+    return results
+
+# Junta os trechos de tempo que se sobrepõem (indices já ordenados pelo início).
+# Retorna uma lista de (trecho, índices das regiões contidas nele)
+def merge_time_spans(regions, indices):
+    spans = []
+    for i in indices:
+        t_start, t_end = regions[i][1]
+        if spans and t_start <= spans[-1][0][1]:
+            spans[-1][0][1] = max(spans[-1][0][1], t_end)
+            spans[-1][1].append(i)
+        else:
+            spans.append(([t_start, t_end], [i]))
+    return spans
+
+# Várias resoluções de uma mesma região. resolutions é uma lista de tuplas
+# (freq_res_type, freq_res, time_res_type, time_res), como os parâmetros de stft_zoom.
+# A filtragem e a subamostragem (zoom_signal: filter_and_decimate, ou filter_and_mod +
+# subsample_signal com fused=False) são feitas uma vez só, e cada resolução é só uma
+# STFT do sinal subamostrado (resoluções com a mesma janela e o mesmo hop são
+# calculadas uma vez e dividem o mesmo resultado). Retorna a lista de (D, x_axis,
+# y_axis) na ordem de resolutions; com combine=True, retorna também a visão combinada
+# de combine_resolutions.
+def stft_zoom_multires(y, freq_range, time_range, sr, resolutions, fused=True, warmup=WARMUP, plan=None, combine=False):
+    with instrument.stage('zoom', freq_range=list(freq_range), time_range=list(time_range), sr=sr,
+                          res=[list(res) for res in resolutions], fused=fused) as stage:
+        y_sub, new_sr, f_min = zoom_signal(y, freq_range, time_range, sr, fused, warmup, plan)
+        by_params = {}
+        results = []
+        for res in resolutions:
+            params = stft_params(len(y_sub), freq_range, new_sr, *res)
+            if params not in by_params:
+                by_params[params] = zoom_axes(stft_db(y_sub, *params), new_sr, f_min, time_range)
+            results.append(by_params[params])
+        stage.set(stfts=len(by_params))
+        if combine:
+            return results, stage.output(*combine_resolutions(list(by_params.values())))
+        return results
+
+# Visão multirresolução de vários (D, x_axis, y_axis) da mesma região: todos são
+# levados (pelo vizinho mais próximo) à grade com mais bins em frequência e mais quadros
+# no tempo entre eles, e cada ponto fica com o menor valor em dB. Uma janela longa
+# espalha os transientes no tempo e uma curta espalha os tons em frequência; o mínimo
+# fica com a resolução que menos espalha em cada ponto. Os dB são refeitos em relação
+# ao máximo da combinação.
+def combine_resolutions(results, top_db=80.0):
+    x_axis = max((x for _, x, _ in results), key=len)
+    y_axis = max((f for _, _, f in results), key=len)
+    combined = np.full((len(y_axis), len(x_axis)), np.inf, dtype=results[0][0].dtype)
+    for D, x, f in results:
+        rows = nearest_index(f, y_axis)
+        cols = nearest_index(x, x_axis)
+        np.minimum(combined, D[rows[:, None], cols], out=combined)
+    combined -= combined.max()
+    return np.maximum(combined, -top_db, out=combined), x_axis, y_axis
+
+# Índices dos pontos de axis (igualmente espaçados) mais próximos de cada valor de grid
+def nearest_index(axis, grid):
+    if len(axis) < 2:
+        return np.zeros(len(grid), dtype=int)
+    idx = np.rint((grid - axis[0]) / (axis[-1] - axis[0]) * (len(axis) - 1)).astype(int)
+    return np.clip(idx, 0, len(axis) - 1)
+
+# Versão em fluxo de stft_zoom (caminho original, filter_and_mod), para gravações que não
+# cabem na memória. blocks é um iterador de blocos de áudio consecutivos (taxa sr); o
+# estado dos filtros (zi), a fase do oscilador, a fase da subamostragem e a sobreposição
+# das janelas da STFT passam de um bloco para o outro, então a memória usada depende só
+# do tamanho dos blocos. É um gerador de (S, x_axis, y_axis) com os quadros que ficaram
+# prontos a cada bloco; S é a magnitude da STFT (não em dB, pois a referência de
+# stft_zoom é o máximo do resultado inteiro): librosa.amplitude_to_db(np.hstack(Ss),
+# ref=np.max) coincide com o D de stft_zoom(..., fused=False) para o mesmo trecho.
+def stft_zoom_stream(blocks, freq_range, sr, freq_res_type, freq_res, time_res_type, time_res, t_start=0):
+    if time_res_type == 'time frames' and time_res != 0:
+        raise ValueError("'time frames' depends on the length of the slice, which is unknown when streaming")
+
+    plan = zoom_plan(freq_range, sr)
+    strategy = plan['strategy']
+    step = subsample_step(plan['new_sr'], sr)
+    new_sr = sr / step
+    n_fft, hop = stft_params(np.inf, freq_range, new_sr, freq_res_type, freq_res, time_res_type, time_res)
+    window = hann(n_fft)
+
+    if strategy == 'lowpass':
+        filters = [design_lowpass(plan['lp_cutoff'], sr)]
+    else:
+        filters = [design_bandpass(plan['wp'], plan['ws'], sr)]
+    zi = [np.zeros((sos.shape[0], 2)) for sos in filters]
+    if strategy == 'ring mod + lpf':
+        lowpass = design_lowpass(plan['lp_cutoff'], sr)
+        zi_lowpass = np.zeros((lowpass.shape[0], 2))
+
+    n_in = 0 # amostras (na taxa sr) já consumidas
+    n_frames = 0 # quadros já devolvidos
+    pending = np.zeros(n_fft // 2) # amostras subamostradas que ainda não formaram quadros
+
+    def ready_frames(pending, n_frames):
+        if len(pending) < n_fft:
+            return np.zeros((n_fft//2 + 1, 0)), np.zeros(0), pending
+        k = 1 + (len(pending) - n_fft) // hop
+        frames = np.lib.stride_tricks.sliding_window_view(pending, n_fft)[::hop][:k]
+        S = np.abs(np.fft.rfft(frames * window, axis=1)).T
+        times = t_start + (n_frames + np.arange(k)) * hop / new_sr
+        return S, times, pending[k * hop:]
+
+    for block in blocks:
+        block = np.asarray(block)
+        if len(block) == 0:
+            continue
+        y_block, zi[0] = scipy.signal.sosfilt(filters[0], block, zi=zi[0])
+        if strategy in ('ring mod', 'ring mod + lpf'):
+            phase = 2*np.pi*plan['mod_freq']*n_in/sr
+            y_block = y_block * np.real(multirate.oscillator(len(y_block), plan['mod_freq'], sr, phase=phase))
+        if strategy == 'ring mod + lpf':
+            y_block, zi_lowpass = scipy.signal.sosfilt(lowpass, y_block, zi=zi_lowpass)
+        pending = np.concatenate((pending, y_block[-n_in % step::step]))
+        n_in += len(block)
+
+        S, times, pending = ready_frames(pending, n_frames)
+        if len(times):
+            n_frames += len(times)
+            yield zoom_axes(S, new_sr, plan['f_min'], [times[0], times[-1]])
+
+    S, times, _ = ready_frames(np.concatenate((pending, np.zeros(n_fft // 2))), n_frames)
+    if len(times):
+        yield zoom_axes(S, new_sr, plan['f_min'], [times[0], times[-1]])
+
 def unmirror(D, y_axis, freq_range):
-    i_start = np.searchsorted(y_axis, freq_range[0])
-    i_stop  = np.searchsorted(y_axis, freq_range[1]) + 1
-    D[i_start:i_stop, :] = D[i_start:i_stop, :][::-1]
-    return D
+    with instrument.stage('unmirror', D) as stage:
+        i_start = np.searchsorted(y_axis, freq_range[0])
+        i_stop  = np.searchsorted(y_axis, freq_range[1]) + 1
+        D[i_start:i_stop, :] = D[i_start:i_stop, :][::-1]
+        return stage.output(D)
 
 
 def get_axes_values(sr, f_min, time_range, spec_shape):
@@ -0,0 +1,167 @@
+import collections
+import json
+import math
+import os
+import shutil
+import numpy as np
+import audio_store
+import stft_zoom
+
+# Multi-level overview spectrogram, stored on disk as a pyramid (map tile
+# style), so opening and panning a long recording does not depend on its
+# length.
+#
+# Level (0, 0) is the STFT of the whole signal (N_FFT, HOP), in dB relative to
+# a fixed reference. Level (t, f) max-pools level (0, 0) by 2**t frames in time
+# and 2**f bins in frequency. Every level is one .npy file, stored time-major
+# so a range of frames is contiguous on disk, and is read through a memory map
+# in tiles of TILE_FRAMES x TILE_BINS. A view only loads the tiles covering it,
+# at the coarsest level that still has a frame per pixel column and a bin per
+# pixel row.
+
+N_FFT = 512
+HOP = N_FFT // 4
+TILE_FRAMES = 1024
+TILE_BINS = 64
+FREQ_LEVELS = 3
+BUILD_FRAMES = 64 * TILE_FRAMES # frames computed at a time while building
+TILE_CACHE_SIZE = 256 # tiles kept in memory, for panning back and forth
+TOP_DB = 80.0
+AMIN = 1e-5
+
+def pyramid_dir(path, sr, cache_dir=audio_store.CACHE_DIR):
+    return os.path.splitext(audio_store.cache_file(path, sr, cache_dir))[0] + '.tiles'
+
+def level_file(directory, t_level, f_level):
+    return os.path.join(directory, 'level_%d_%d.npy' % (t_level, f_level))
+
+# Opens the pyramid for the file at path (y is its decoded signal, see
+# audio_store.open_audio), building it first if it is not cached yet
+def open_pyramid(path, y, sr=44100, cache_dir=audio_store.CACHE_DIR):
+    directory = pyramid_dir(path, sr, cache_dir)
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        build_pyramid(y, sr, directory)
+    return TilePyramid(directory)
+
+def build_pyramid(y, sr, directory):
+    tmp = directory + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    n_frames = 1 + len(y) // HOP
+    n_bins = N_FFT // 2 + 1
+    base = np.lib.format.open_memmap(level_file(tmp, 0, 0), mode='w+', dtype=np.float32, shape=(n_frames, n_bins))
+    db_max = -np.inf
+    for start in range(0, n_frames, BUILD_FRAMES):
+        stop = min(start + BUILD_FRAMES, n_frames)
+        stft_zoom.stft_db(y, N_FFT, HOP, start, stop, out=base[start:stop].T, ref=1.0, amin=AMIN, top_db=None)
+        db_max = max(db_max, float(base[start:stop].max()))
+    base.flush()
+
+    t_levels = 1
+    while n_frames > TILE_FRAMES:
+        n_frames = pool_level(tmp, (t_levels - 1, 0), (t_levels, 0), axis=0)
+        t_levels += 1
+    for t_level in range(t_levels):
+        for f_level in range(1, FREQ_LEVELS):
+            pool_level(tmp, (t_level, f_level - 1), (t_level, f_level), axis=1)
+
+    meta = {'sr': sr, 'n_fft': N_FFT, 'hop': HOP, 'n_samples': len(y),
+            't_levels': t_levels, 'f_levels': FREQ_LEVELS, 'db_max': db_max}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp, directory)
+
+# Max-pools pairs of frames (axis=0) or bins (axis=1) of one level into the
+# next one, a block of frames at a time. Returns the new number of frames.
+def pool_level(directory, src_level, dst_level, axis):
+    src = np.load(level_file(directory, *src_level), mmap_mode='r')
+    shape = list(src.shape)
+    shape[axis] = (shape[axis] + 1) // 2
+    dst = np.lib.format.open_memmap(level_file(directory, *dst_level), mode='w+', dtype=src.dtype, shape=tuple(shape))
+    for start in range(0, src.shape[0], 2 * BUILD_FRAMES):
+        pooled = pool_pairs(np.asarray(src[start : start + 2 * BUILD_FRAMES]), axis)
+        dst_start = start // 2 if axis == 0 else start
+        dst[dst_start : dst_start + pooled.shape[0]] = pooled
+    dst.flush()
+    return shape[0]
+
+def pool_pairs(block, axis):
+    if block.shape[axis] % 2:
+        edge = np.take(block, [-1], axis=axis)
+        block = np.concatenate((block, edge), axis=axis)
+    if axis == 0:
+        return np.maximum(block[0::2], block[1::2])
+    return np.maximum(block[:, 0::2], block[:, 1::2])
+
+class TilePyramid:
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.sr = self.meta['sr']
+        self.duration = self.meta['n_samples'] / self.sr
+        self.levels = {}
+        for t_level in range(self.meta['t_levels']):
+            for f_level in range(self.meta['f_levels']):
+                self.levels[t_level, f_level] = np.load(level_file(directory, t_level, f_level), mmap_mode='r')
+        self._tiles = collections.OrderedDict()
+
+    def frame_period(self, t_level):
+        return self.meta['hop'] * 2**t_level / self.sr
+
+    def bin_width(self, f_level):
+        return self.sr / self.meta['n_fft'] * 2**f_level
+
+    # Coarsest level that still has at least one frame per column and one bin
+    # per row of the view
+    def choose_level(self, time_range, freq_range, width, height):
+        frames = (time_range[1] - time_range[0]) / self.frame_period(0)
+        bins = (freq_range[1] - freq_range[0]) / self.bin_width(0)
+        t_level = int(math.floor(math.log2(max(frames / width, 1))))
+        f_level = int(math.floor(math.log2(max(bins / height, 1))))
+        return min(t_level, self.meta['t_levels'] - 1), min(f_level, self.meta['f_levels'] - 1)
+
+    def tile(self, t_level, f_level, i, j):
+        key = (t_level, f_level, i, j)
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            return self._tiles[key]
+        level = self.levels[t_level, f_level]
+        tile = np.array(level[i*TILE_FRAMES : (i+1)*TILE_FRAMES, j*TILE_BINS : (j+1)*TILE_BINS])
+        self._tiles[key] = tile
+        if len(self._tiles) > TILE_CACHE_SIZE:
+            self._tiles.popitem(last=False)
+        return tile
+
+    # Spectrogram of the viewport, as (D, x_axis, y_axis) like
+    # gui_util.get_spectrogram: D in dB relative to the maximum of the whole
+    # file, clipped TOP_DB below it. width and height are the viewport size in
+    # pixels.
+    def view(self, time_range=None, freq_range=None, width=1024, height=512):
+        if time_range is None:
+            time_range = [0, self.duration]
+        if freq_range is None:
+            freq_range = [0, self.sr / 2]
+        t_level, f_level = self.choose_level(time_range, freq_range, width, height)
+        level = self.levels[t_level, f_level]
+        dt = self.frame_period(t_level)
+        df = self.bin_width(f_level)
+
+        i0 = max(int(time_range[0] / dt), 0)
+        i1 = min(int(math.ceil(time_range[1] / dt)) + 1, level.shape[0])
+        j0 = max(int(freq_range[0] / df), 0)
+        j1 = min(int(math.ceil(freq_range[1] / df)) + 1, level.shape[1])
+
+        tiles = [[self.tile(t_level, f_level, i, j) for j in range(j0 // TILE_BINS, (j1 - 1) // TILE_BINS + 1)]
+                 for i in range(i0 // TILE_FRAMES, (i1 - 1) // TILE_FRAMES + 1)]
+        block = np.block(tiles)
+        i_off = (i0 // TILE_FRAMES) * TILE_FRAMES
+        j_off = (j0 // TILE_BINS) * TILE_BINS
+        D = block[i0 - i_off : i1 - i_off, j0 - j_off : j1 - j_off].T
+        D = np.maximum(D - self.meta['db_max'], -TOP_DB)
+
+        # centres of the pooled frames / bins
+        x_axis = (np.arange(i0, i1) + (1 - 2.0**-t_level) / 2) * dt
+        y_axis = (np.arange(j0, j1) + (1 - 2.0**-f_level) / 2) * df
+        return D, x_axis, y_axis
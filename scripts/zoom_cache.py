@@ -0,0 +1,171 @@
+import collections
+import threading
+import weakref
+import instrument
+import planner
+import stft_zoom
+
+# Cache of stft_zoom results. Entries are keyed on the identity of the audio,
+# the band and the resolution parameters, hold the STFT magnitude (the dB
+# conversion is relative to the maximum of each result, so it is redone on
+# every answer) and are evicted least recently used first once their total
+# size goes over the memory budget.
+#
+# A request that is not cached by itself but whose frames are a subset of a
+# cached result (same band and resolution, time range inside the cached one
+# and starting on its hop grid) is answered by slicing the cached frames.
+# Such a result is not exactly the one stft_zoom would return for time_range:
+# the frames at its edges see the signal around them instead of zero padding
+# (up to tens of dB of difference in the first and last window / hop frames),
+# the frames near its start have no filter warm-up transient, and the dB are
+# relative to the maximum of the slice. So the answer for a time range can
+# depend on what was cached before it.
+#
+# Without file_id, the audio is identified by id(y), and a weak reference to
+# y is kept to tell when that id has been reused by another array: the entries
+# of the old one are then dropped.
+#
+# A ZoomCache can be shared by several threads (see jobs.py); the lock is only
+# held while looking up and storing entries, not while computing.
+
+DEFAULT_BUDGET = 256 * 2**20 # bytes
+PREVIEW_TIME = 0.1 # seconds; zooms estimated to be faster than this get no preview
+PREVIEW_FRACTION = 0.25 # nor those whose preview is estimated to take more than this fraction of them
+
+class ZoomCache:
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.nbytes = 0
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._sources = {} # id(y) -> weak reference to y, for entries without file_id
+        self._lock = threading.Lock()
+
+    def info(self):
+        return {'hits': self.hits, 'partial_hits': self.partial_hits, 'misses': self.misses,
+                'entries': len(self._entries), 'nbytes': self.nbytes, 'budget': self.budget}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sources.clear()
+            self.nbytes = 0
+
+    # Same parameters and result as planner.zoom (the cheapest plan for the band).
+    # file_id identifies the audio (e.g. its path); by default it is id(y), in
+    # which case y must not be modified while it is cached. progress is passed
+    # on as in planner.zoom.
+    def zoom(self, y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res,
+             fused=True, warmup=stft_zoom.WARMUP, file_id=None, progress=None):
+        res = (freq_res_type, freq_res, time_res_type, time_res)
+        time_range = tuple(time_range)
+
+        with instrument.stage('zoom', freq_range=list(freq_range), time_range=list(time_range), sr=sr,
+                              res=list(res), fused=fused) as stage:
+            with self._lock:
+                key = (self._source(y, file_id), tuple(freq_range), sr, res, fused, warmup)
+                found = self._lookup(key, time_range, freq_range, sr, res)
+                if found is None:
+                    self.misses += 1
+            stage.set(cache='miss' if found is None else 'hit')
+            if found is None:
+                plan = planner.choose(freq_range, time_range, sr, *res, fused=fused, warmup=warmup)
+                stage.set(strategy=plan['strategy'])
+                if progress is not None:
+                    progress(0.0, 'filtering')
+                y_sub, new_sr, f_min = stft_zoom.zoom_signal(y, freq_range, time_range, sr, fused, warmup, plan)
+                if progress is not None:
+                    progress(planner.filter_fraction(plan), 'stft')
+                S = stft_zoom.stft_magnitude(y_sub, freq_range, new_sr, *res)
+                params = stft_zoom.stft_params(len(y_sub), freq_range, new_sr, *res)
+                with self._lock:
+                    self._store((key, time_range), (S, new_sr, f_min, params))
+            else:
+                S, new_sr, f_min = found
+
+            D = stft_zoom.magnitude_to_db(S) # not in place, S is cached
+            return stage.output(*stft_zoom.zoom_axes(D, new_sr, f_min, time_range))
+
+    # Generator version of zoom (see stft_zoom.stft_zoom_progressive): yields a
+    # stft_zoom.zoom_preview first and then the result of zoom, except when
+    # the result is cached, is estimated to take less than PREVIEW_TIME or
+    # the preview would not be much faster (planner.preview_time; narrow bands
+    # at the full rate).
+    def zoom_progressive(self, y, freq_range, time_range, sr, freq_res_type, freq_res, time_res_type, time_res,
+                         fused=True, warmup=stft_zoom.WARMUP, file_id=None, progress=None):
+        res = (freq_res_type, freq_res, time_res_type, time_res)
+        with self._lock:
+            key = (self._source(y, file_id), tuple(freq_range), sr, res, fused, warmup)
+            cached = self._lookup(key, tuple(time_range), freq_range, sr, res, count=False) is not None
+        if not cached:
+            plan = planner.choose(freq_range, time_range, sr, *res, fused=fused, warmup=warmup)
+            full_time = plan['cost']['time']
+            if full_time > PREVIEW_TIME and planner.preview_time(freq_range, time_range, sr, *res) < PREVIEW_FRACTION * full_time:
+                yield stft_zoom.zoom_preview(y, freq_range, time_range, sr, *res)
+        yield self.zoom(y, freq_range, time_range, sr, *res, fused=fused, warmup=warmup, file_id=file_id, progress=progress)
+
+    # Identity of the audio in the keys: file_id, or id(y). If id(y) belonged
+    # to an array that is gone, its entries are dropped first.
+    def _source(self, y, file_id):
+        if file_id is not None:
+            return file_id
+        ref = self._sources.get(id(y))
+        if ref is None or ref() is not y:
+            for entry_key in [entry_key for entry_key in self._entries if entry_key[0][0] == id(y)]:
+                self.nbytes -= self._entries.pop(entry_key)[0].nbytes
+            for source in [source for source, ref in self._sources.items() if ref() is None]:
+                del self._sources[source]
+            self._sources[id(y)] = weakref.ref(y)
+        return id(y)
+
+    # count=False looks up without touching the hit counters
+    def _lookup(self, key, time_range, freq_range, sr, res, count=True):
+        exact = (key, time_range)
+        if exact in self._entries:
+            self._entries.move_to_end(exact)
+            self.hits += count
+            S, new_sr, f_min, _ = self._entries[exact]
+            return S, new_sr, f_min
+
+        for (entry_key, entry_range), entry in self._entries.items():
+            if entry_key != key or not (entry_range[0] <= time_range[0] and time_range[1] <= entry_range[1]):
+                continue
+            frames = subset_frames(entry, entry_range, time_range, freq_range, sr, res)
+            if frames is not None:
+                self._entries.move_to_end((entry_key, entry_range))
+                self.partial_hits += count
+                S, new_sr, f_min, _ = entry
+                return S[:, frames], new_sr, f_min
+        return None
+
+    def _store(self, entry_key, entry):
+        size = entry[0].nbytes
+        if size > self.budget:
+            return
+        if entry_key in self._entries: # computed again by another thread meanwhile
+            self.nbytes -= self._entries.pop(entry_key)[0].nbytes
+        self._entries[entry_key] = entry
+        self.nbytes += size
+        while self.nbytes > self.budget:
+            _, (S, _, _, _) = self._entries.popitem(last=False)
+            self.nbytes -= S.nbytes
+
+# Frames of a cached result (computed for entry_range) that make up the result
+# for time_range, as a slice, or None if they are not on the same hop grid
+def subset_frames(entry, entry_range, time_range, freq_range, sr, res):
+    S, new_sr, _, params = entry
+    step = int(round(sr / new_sr))
+    offset = int(sr * time_range[0]) - int(sr * entry_range[0])
+    if offset % step:
+        return None
+    n_sub = -(-(int(sr * time_range[1]) - int(sr * time_range[0])) // step)
+    window_size, hop_size = stft_zoom.stft_params(n_sub, freq_range, new_sr, *res)
+    if (window_size, hop_size) != params or (offset // step) % hop_size:
+        return None
+    first = (offset // step) // hop_size
+    n_frames = 1 + (n_sub + 2*(window_size // 2) - window_size) // hop_size # as stft_zoom.stft
+    if first + n_frames > S.shape[1]:
+        return None
+    return slice(first, first + n_frames)